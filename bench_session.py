@@ -0,0 +1,94 @@
+import argparse
+import asyncio
+import time
+from typing import Any, Dict, List, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramAPIError
+
+from bot import BOT_API_CONNECTION_LIMIT, TunedAiohttpSession
+from stub_api import StubBotAPI, STUB_BOT_TOKEN
+
+
+# Сравнение сессии aiogram по умолчанию с настроенной сессией на локальной заглушке Bot API.
+# Нагрузка повторяет работу бота: всплески ответов на нажатия (answerCallbackQuery) больше лимита
+# пула aiogram, паузы между ними дольше keep-alive aiohttp (15 сек.) и редкие зависшие ответы,
+# которые настроенная сессия обрывает по таймауту метода, а сессия по умолчанию ждет до 60 сек.
+async def run_bursts(bot: Bot, bursts: int, burst_size: int, pause: float) -> Tuple[List[float], int]:
+    latencies = []
+    errors = 0
+
+    async def call(i: int):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            await bot.answer_callback_query(callback_query_id=str(i))
+        except TelegramAPIError:
+            errors += 1
+        latencies.append(time.perf_counter() - started)
+
+    for burst in range(bursts):
+        if burst:
+            await asyncio.sleep(pause)
+        await asyncio.gather(*(call(i + 1) for i in range(burst_size)))
+    return latencies, errors
+
+
+async def bench(name: str, session: AiohttpSession, stub: StubBotAPI, args) -> Dict[str, Any]:
+    bot = Bot(token=STUB_BOT_TOKEN, session=session)
+    connections_before = stub.connections
+    started = time.perf_counter()
+    latencies, errors = await run_bursts(bot, args.bursts, args.burst_size, args.pause)
+    elapsed = time.perf_counter() - started - (args.bursts - 1) * args.pause
+    await session.close()
+
+    latencies.sort()
+
+    def percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    return {
+        'session': name,
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(0.5),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'max_ms': latencies[-1] * 1000,
+        'connections': stub.connections - connections_before,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк HTTP-сессии Bot API на локальной заглушке')
+    parser.add_argument('--bursts', type=int, default=3, help='число всплесков запросов')
+    parser.add_argument('--burst-size', type=int, default=250, help='запросов в одном всплеске (больше лимита aiogram в 100)')
+    parser.add_argument('--pause', type=float, default=16, help='пауза между всплесками, сек. (больше keep-alive aiohttp в 15)')
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка ответа заглушки, сек.')
+    parser.add_argument('--stall-every', type=int, default=100, help='каждый N-й ответ заглушки зависает (0 - без зависаний)')
+    parser.add_argument('--stall', type=float, default=8, help='время зависания ответа, сек.')
+    parser.add_argument('--limit', type=int, default=BOT_API_CONNECTION_LIMIT, help='лимит соединений настроенной сессии')
+    args = parser.parse_args()
+
+    stub = StubBotAPI(latency=args.latency, stall_every=args.stall_every, stall=args.stall)
+    url = await stub.start()
+    api = TelegramAPIServer.from_base(url)
+
+    results = [
+        await bench('default', AiohttpSession(api=api), stub, args),
+        await bench('tuned', TunedAiohttpSession(api=api, limit=args.limit), stub, args),
+    ]
+    await stub.stop()
+
+    print(f"{'session':<10}{'requests':>10}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{'max ms':>10}{'conns':>8}")
+    for r in results:
+        print(f"{r['session']:<10}{r['requests']:>10}{r['errors']:>8}{r['rps']:>10.0f}{r['p50_ms']:>10.1f}"
+              f"{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}{r['connections']:>8}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
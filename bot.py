@@ -1,11 +1,30 @@
 import logging
+import logging.handlers
 import json
 import os
 import asyncio
 import signal
 import sys
-from typing import Dict, List, Tuple, Any, Optional
-from collections import defaultdict
+import time
+import bisect
+import html
+import base64
+import zlib
+import gzip
+import hmac
+import hashlib
+import queue
+import atexit
+import contextvars
+import copy
+import threading
+from array import array
+from datetime import datetime
+from typing import Dict, List, Set, Tuple, Any, Optional, Callable, Awaitable
+from collections import defaultdict, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
 from dataclasses import dataclass, field
 from enum import Enum
 
@@ -19,37 +38,342 @@ from aiogram.types import (
     CallbackQuery, 
     InlineKeyboardButton, 
     InlineKeyboardMarkup,
+    BufferedInputFile,
+    ChatMember,
+    ChatMemberUpdated,
     Update
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from aiogram.enums import ParseMode
+from aiogram.enums import ParseMode, ChatMemberStatus
 from aiogram.client.default import DefaultBotProperties
-from aiogram.exceptions import TelegramRetryAfter, TelegramAPIError
+from aiogram.exceptions import TelegramRetryAfter, TelegramAPIError, TelegramNetworkError
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram import __version__ as aiogram_version
 
 # Добавляем импорт для HTTP-сервера
-from aiohttp import web
+from aiohttp import web, ClientSession, TraceConfig, hdrs
+from aiohttp.http import SERVER_SOFTWARE
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.StreamHandler(sys.stdout)]
-)
+# Настройка логирования: запись в stdout идет в отдельном потоке через очередь
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # json или text
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_SAMPLE_LIMIT = int(os.environ.get('LOG_SAMPLE_LIMIT', 10))  # записей одного вида за интервал
+LOG_SAMPLE_INTERVAL = float(os.environ.get('LOG_SAMPLE_INTERVAL', 60))
+LOG_SAMPLED_LOGGERS = ('aiogram.event', 'aiohttp.access')  # логгеры, которые пишут на каждое обновление/запрос
+
+# Идентификатор трассировки текущего обновления
+trace_id_var: contextvars.ContextVar[str] = contextvars.ContextVar('trace_id', default='-')
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = trace_id_var.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Пропускает не больше limit записей одного шаблона за interval секунд.
+    
+    Применяется к записям не выше INFO с extra={'sample': True} и из логгеров LOG_SAMPLED_LOGGERS;
+    предупреждения и ошибки (например, падения обработчиков в aiogram.event) проходят всегда.
+    Число пропущенных записей добавляется к первой записи следующего интервала.
+    """
+    def __init__(self, limit: int, interval: float):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self._windows: Dict[Tuple[str, Any], Tuple[float, int, int]] = {}
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        if not getattr(record, 'sample', False) and record.name not in LOG_SAMPLED_LOGGERS:
+            return True
+        
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        started, passed, suppressed = self._windows.get(key, (now, 0, 0))
+        if now - started >= self.interval:
+            if suppressed:
+                record.msg = f"{record.msg} (пропущено похожих записей: {suppressed})"
+            started, passed, suppressed = now, 0, 0
+        
+        if passed < self.limit:
+            self._windows[key] = (started, passed + 1, suppressed)
+            return True
+        self._windows[key] = (started, passed, suppressed + 1)
+        return False
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'trace_id': getattr(record, 'trace_id', '-'),
+            'message': record.getMessage(),
+        }
+        # Трассировку исключения подготовил LogQueueHandler.prepare
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который передает трассировку исключения в exc_text, а не склеивает ее с сообщением"""
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # exc_info нельзя передать в очередь как есть: в нем объекты кадров, поэтому сохраняем текст
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+def setup_logging() -> logging.handlers.QueueListener:
+    log_queue = queue.SimpleQueue()
+    
+    output = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s'))
+    
+    # Фильтры работают в вызывающем коде: там доступен trace_id, а отброшенные записи не попадают в очередь
+    queue_handler = LogQueueHandler(log_queue)
+    queue_handler.addFilter(TraceIdFilter())
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_LIMIT, LOG_SAMPLE_INTERVAL))
+    
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.handlers[:] = [queue_handler]
+    
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    # Остановка слушателя дописывает оставшиеся в очереди записи
+    atexit.register(listener.stop)
+    return listener
+
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
 
 # Глобальные переменные
 bot_instance_running = False
 
+# Файл с данными опросов
+DATA_FILE = os.environ.get('POLL_DATA_FILE', 'poll_data.json')
+
+# Колонки ответов и динамика голосов пишутся не в общий снимок, а в файлы по опросам: только измененные и раз в интервал, сек.
+ANALYTICS_DIR = os.environ.get('POLL_ANALYTICS_DIR', 'poll_analytics')
+ANALYTICS_FLUSH_INTERVAL = float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', 30))
+
+# Сколько обновление может ждать окончания загрузки данных, сек.
+DATA_LOAD_WAIT_TIMEOUT = float(os.environ.get('DATA_LOAD_WAIT_TIMEOUT', 60))
+
+# Общий срок на завершение обработчиков и сброс данных при остановке, сек.
+SHUTDOWN_DRAIN_TIMEOUT = float(os.environ.get('SHUTDOWN_DRAIN_TIMEOUT', 20))
+
+# Ограничение частоты нажатий кнопок: скорость (токенов/сек.) и запас токенов
+THROTTLE_USER_RATE = float(os.environ.get('THROTTLE_USER_RATE', 2))
+THROTTLE_USER_BURST = float(os.environ.get('THROTTLE_USER_BURST', 5))
+THROTTLE_CHAT_RATE = float(os.environ.get('THROTTLE_CHAT_RATE', 20))
+THROTTLE_CHAT_BURST = float(os.environ.get('THROTTLE_CHAT_BURST', 40))
+
+# Сброс нагрузки: включается при HIGH обрабатываемых обновлений, выключается при LOW
+LOAD_SHED_HIGH_WATERMARK = int(os.environ.get('LOAD_SHED_HIGH_WATERMARK', 200))
+LOAD_SHED_LOW_WATERMARK = int(os.environ.get('LOAD_SHED_LOW_WATERMARK', 100))
+
+# Холодный архив: опросы без ответов дольше ARCHIVE_AFTER_DAYS выгружаются из памяти
+ARCHIVE_DIR = os.environ.get('POLL_ARCHIVE_DIR', 'poll_archive')
+ARCHIVE_AFTER_DAYS = float(os.environ.get('ARCHIVE_AFTER_DAYS', 30))
+ARCHIVE_CHECK_INTERVAL = float(os.environ.get('ARCHIVE_CHECK_INTERVAL', 3600))
+
+# Запись входящих обновлений для воспроизведения нагрузки (replay.py)
+UPDATE_RECORD_PATH = os.environ.get('UPDATE_RECORD_PATH', '')
+UPDATE_RECORD_ANONYMIZE = os.environ.get('UPDATE_RECORD_ANONYMIZE', '1') == '1'
+UPDATE_RECORD_SALT = os.environ.get('UPDATE_RECORD_SALT', '') or os.urandom(16).hex()
+# Сброс сжатого потока на диск: после сбоя запись читается до последнего сброса
+UPDATE_RECORD_FLUSH_EVERY = int(os.environ.get('UPDATE_RECORD_FLUSH_EVERY', 100))
+UPDATE_RECORD_FLUSH_INTERVAL = float(os.environ.get('UPDATE_RECORD_FLUSH_INTERVAL', 1))
+
 # Токен бота
 API_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '8400306221:AAGk7HnyDytn8ymhqTqNWZI8KtxW6CChb-E')
 
+# Настройки HTTP-сессии для Bot API. Отличия от aiogram по умолчанию: лимит соединений 256 вместо 100
+# (всплески ответов на нажатия не ждут в очереди пула), keep-alive 60 сек. вместо 15 сек. aiohttp
+# (соединения переживают паузы между всплесками), таймаут 30 сек. вместо 60 и таймауты по методам ниже.
+# TTL кэша DNS совпадает с aiogram и вынесен только для настройки
+BOT_API_CONNECTION_LIMIT = int(os.environ.get('BOT_API_CONNECTION_LIMIT', 256))
+BOT_API_KEEPALIVE_TIMEOUT = float(os.environ.get('BOT_API_KEEPALIVE_TIMEOUT', 60))
+BOT_API_DNS_CACHE_TTL = int(os.environ.get('BOT_API_DNS_CACHE_TTL', 3600))
+BOT_API_TIMEOUT = float(os.environ.get('BOT_API_TIMEOUT', 30))
+
+# Таймауты отдельных методов, переопределяются переменной вида "sendDocument=120,answerCallbackQuery=5"
+BOT_API_METHOD_TIMEOUTS = {
+    'answerCallbackQuery': 5,
+    'getChatMember': 10,
+    'sendMessage': 15,
+    'editMessageText': 15,
+    'sendDocument': 60,
+    'getFile': 30,
+}
+for item in filter(None, os.environ.get('BOT_API_METHOD_TIMEOUTS', '').split(',')):
+    method_name, _, method_timeout = item.partition('=')
+    BOT_API_METHOD_TIMEOUTS[method_name.strip()] = float(method_timeout)
+
+class SessionMetrics:
+    """Метрики пула соединений и запросов к Bot API"""
+    def __init__(self, latency_window: int = 1000):
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.queued = 0
+        self.queued_time = 0.0
+        self.requests_total = 0
+        self.requests_failed = 0  # все ошибки Bot API, включая сетевые
+        self.requests_network_errors = 0
+        self.requests_in_flight = 0
+        self.latencies: deque = deque(maxlen=latency_window)
+    
+    def trace_config(self) -> TraceConfig:
+        trace_config = TraceConfig()
+        
+        async def on_connection_create_end(session, context, params):
+            self.connections_created += 1
+        
+        async def on_connection_reuseconn(session, context, params):
+            self.connections_reused += 1
+        
+        async def on_connection_queued_start(session, context, params):
+            context.queued_started = time.perf_counter()
+            self.queued += 1
+        
+        async def on_connection_queued_end(session, context, params):
+            self.queued_time += time.perf_counter() - context.queued_started
+        
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_connection_queued_start.append(on_connection_queued_start)
+        trace_config.on_connection_queued_end.append(on_connection_queued_end)
+        return trace_config
+    
+    def snapshot(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        
+        def percentile(p: float) -> float:
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else 0.0
+        
+        return {
+            'connections_created': self.connections_created,
+            'connections_reused': self.connections_reused,
+            'connection_queued': self.queued,
+            'connection_queued_seconds': round(self.queued_time, 6),
+            'requests_total': self.requests_total,
+            'requests_failed': self.requests_failed,
+            'requests_network_errors': self.requests_network_errors,
+            'requests_in_flight': self.requests_in_flight,
+            'latency_p50': round(percentile(0.5), 6),
+            'latency_p95': round(percentile(0.95), 6),
+            'latency_p99': round(percentile(0.99), 6),
+        }
+
+# create_session повторяет AiohttpSession.create_session из этой версии aiogram (requirements.txt),
+# добавляя trace_configs: ClientSession принимает их только при создании. При обновлении aiogram сверить
+TUNED_SESSION_AIOGRAM_VERSION = '3.17.0'
+
+class TunedAiohttpSession(AiohttpSession):
+    """Сессия aiogram с настроенным пулом соединений, keep-alive и таймаутами по методам"""
+    def __init__(self, limit: int = BOT_API_CONNECTION_LIMIT, keepalive_timeout: float = BOT_API_KEEPALIVE_TIMEOUT,
+                 ttl_dns_cache: int = BOT_API_DNS_CACHE_TTL, method_timeouts: Optional[Dict[str, float]] = None,
+                 **kwargs: Any):
+        if aiogram_version != TUNED_SESSION_AIOGRAM_VERSION:
+            logger.warning(f"TunedAiohttpSession написана для aiogram {TUNED_SESSION_AIOGRAM_VERSION}, "
+                           f"установлена {aiogram_version}: сверьте create_session с AiohttpSession")
+        kwargs.setdefault('timeout', BOT_API_TIMEOUT)
+        super().__init__(limit=limit, **kwargs)
+        # Применяются при каждом создании коннектора, поэтому сохраняются и после смены proxy
+        self.connector_tuning = {
+            'limit': limit,
+            'keepalive_timeout': keepalive_timeout,
+            'use_dns_cache': True,
+            'ttl_dns_cache': ttl_dns_cache,
+        }
+        self.method_timeouts = BOT_API_METHOD_TIMEOUTS if method_timeouts is None else method_timeouts
+        self.metrics = SessionMetrics()
+    
+    async def create_session(self) -> ClientSession:
+        if self._should_reset_connector:
+            await self.close()
+        
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                connector=self._connector_type(**{**self._connector_init, **self.connector_tuning}),
+                headers={hdrs.USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{aiogram_version}"},
+                trace_configs=[self.metrics.trace_config()],
+            )
+            self._should_reset_connector = False
+        
+        return self._session
+    
+    async def make_request(self, bot: Bot, method, timeout: Optional[int] = None):
+        api_method = method.__api_method__
+        if timeout is None:
+            timeout = self.method_timeouts.get(api_method)
+        
+        self.metrics.requests_total += 1
+        self.metrics.requests_in_flight += 1
+        started = time.perf_counter()
+        try:
+            return await super().make_request(bot, method, timeout)
+        except asyncio.CancelledError:
+            # aiohttp 3.9.0 при таймауте на переиспользованном соединении иногда выпускает CancelledError
+            # из записи тела запроса вместо TimeoutError; настоящую отмену задачи пробрасываем как есть
+            task = asyncio.current_task()
+            if task is None or task.cancelling():
+                raise
+            self.metrics.requests_failed += 1
+            self.metrics.requests_network_errors += 1
+            raise TelegramNetworkError(method=method, message="Request timeout error")
+        except TelegramAPIError as e:
+            self.metrics.requests_failed += 1
+            if isinstance(e, TelegramNetworkError):
+                self.metrics.requests_network_errors += 1
+            raise
+        finally:
+            self.metrics.requests_in_flight -= 1
+            # getUpdates - это long polling, его время не показательно
+            if api_method != 'getUpdates':
+                elapsed = time.perf_counter() - started
+                self.metrics.latencies.append(elapsed)
+                logger.debug(f"Bot API {api_method}: {elapsed:.3f} сек.")
+
 # Инициализация бота
 bot = Bot(
     token=API_TOKEN,
+    session=TunedAiohttpSession(),
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
 storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+
+class TracingDispatcher(Dispatcher):
+    """Присваивает обновлению trace_id, который попадает во все записи лога при его обработке.
+    
+    trace_id выставляется вокруг всей обработки, а не в middleware: так он есть и в строке aiogram
+    «Update id=… is handled» и в записи о необработанном исключении. _process_update — внутренний метод
+    aiogram, сверять при обновлении вместе с TUNED_SESSION_AIOGRAM_VERSION.
+    """
+    async def feed_update(self, bot: Bot, update: Update, **kwargs: Any) -> Any:
+        token = trace_id_var.set(f"u{update.update_id}")
+        try:
+            return await super().feed_update(bot, update, **kwargs)
+        finally:
+            trace_id_var.reset(token)
+    
+    async def _process_update(self, bot: Bot, update: Update, call_answer: bool = True, **kwargs: Any) -> bool:
+        token = trace_id_var.set(f"u{update.update_id}")
+        try:
+            return await super()._process_update(bot, update, call_answer, **kwargs)
+        finally:
+            trace_id_var.reset(token)
+
+dp = TracingDispatcher(storage=storage)
 
 # Классы данных для структуры опроса
 @dataclass
@@ -69,7 +393,550 @@ class Poll:
     name: str
     questions: List[Question]
     created_by: int
-    created_at: str = field(default_factory=lambda: __import__('datetime').datetime.now().isoformat())
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat())
+
+# Индекс опросов администратора для постраничного вывода
+MY_POLLS_PAGE_SIZE = 10
+POLL_SORT_ORDERS = ('created', 'name', 'activity')
+POLL_SORT_LABELS = {
+    'created': 'по дате создания',
+    'name': 'по названию',
+    'activity': 'по активности',
+}
+
+class SortedPollIndex:
+    """Отсортированный список ключей (значение сортировки, poll_id)"""
+    def __init__(self):
+        self.keys: List[Tuple[Any, int]] = []
+        self.key_of: Dict[int, Tuple[Any, int]] = {}
+    
+    def insert(self, poll_id: int, sort_value: Any):
+        self.remove(poll_id)
+        key = (sort_value, poll_id)
+        bisect.insort(self.keys, key)
+        self.key_of[poll_id] = key
+    
+    def remove(self, poll_id: int):
+        key = self.key_of.pop(poll_id, None)
+        if key is None:
+            return
+        pos = bisect.bisect_left(self.keys, key)
+        if pos < len(self.keys) and self.keys[pos] == key:
+            del self.keys[pos]
+    
+    def bounds(self, prefix: str = '') -> Tuple[int, int]:
+        # Префиксный поиск имеет смысл только для индекса по названию
+        if not prefix:
+            return 0, len(self.keys)
+        lo = bisect.bisect_left(self.keys, (prefix,))
+        hi = bisect.bisect_left(self.keys, (prefix + '\U0010ffff',))
+        return lo, hi
+    
+    def page(self, cursor: Optional[int], direction: str, prefix: str, size: int) -> Tuple[List[int], bool, bool]:
+        lo, hi = self.bounds(prefix)
+        key = self.key_of.get(cursor) if cursor is not None else None
+        # Курсор из другой выборки (например, кнопка со старой клавиатуры) - начинаем с первой страницы
+        if key is not None and not lo <= bisect.bisect_left(self.keys, key) < hi:
+            key = None
+        
+        if key is not None and direction == 'prev':
+            end = min(hi, max(lo, bisect.bisect_left(self.keys, key)))
+            start = max(lo, end - size)
+            if end - start < size:
+                end = min(hi, start + size)
+        else:
+            start = lo
+            if key is not None:
+                start = min(hi, max(lo, bisect.bisect_right(self.keys, key)))
+            end = min(hi, start + size)
+        
+        poll_ids = [poll_id for _, poll_id in self.keys[start:end]]
+        return poll_ids, start > lo, end < hi
+
+class AdminPollIndex:
+    """Индексы опросов каждого администратора по всем порядкам сортировки"""
+    def __init__(self):
+        self._indexes: Dict[int, Dict[str, SortedPollIndex]] = {}
+    
+    def _admin(self, admin_id: int) -> Dict[str, SortedPollIndex]:
+        if admin_id not in self._indexes:
+            self._indexes[admin_id] = {order: SortedPollIndex() for order in POLL_SORT_ORDERS}
+        return self._indexes[admin_id]
+    
+    def add(self, admin_id: int, poll_id: int, name: str, activity: float):
+        indexes = self._admin(admin_id)
+        indexes['created'].insert(poll_id, -poll_id)
+        indexes['name'].insert(poll_id, name.casefold())
+        indexes['activity'].insert(poll_id, -activity)
+    
+    def touch(self, admin_id: int, poll_id: int, activity: float):
+        self._admin(admin_id)['activity'].insert(poll_id, -activity)
+    
+    def page(self, admin_id: int, order: str, cursor: Optional[int] = None, direction: str = 'next',
+             prefix: str = '', size: int = MY_POLLS_PAGE_SIZE) -> Tuple[List[int], bool, bool]:
+        if admin_id not in self._indexes:
+            return [], False, False
+        return self._indexes[admin_id][order].page(cursor, direction, prefix.casefold(), size)
+
+# Граф вопросов и воронка прохождения веток
+@dataclass
+class CompiledPollGraph:
+    answer_index: List[Dict[str, int]]  # по вопросу: текст ответа -> индекс ответа
+    next_question: List[List[Optional[int]]]  # по вопросу: индекс ответа -> следующий вопрос
+    order: List[Tuple[int, int]]  # (индекс вопроса, глубина) в порядке обхода в глубину
+
+def compile_poll_graph(poll: Poll) -> CompiledPollGraph:
+    answer_index = []
+    next_question = []
+    for question in poll.questions:
+        answer_index.append({answer.text: a_idx for a_idx, answer in enumerate(question.answers)})
+        next_question.append([
+            answer.next_question if answer.next_question is not None and answer.next_question < len(poll.questions) else None
+            for answer in question.answers
+        ])
+    
+    order = []
+    visited = set()
+    stack = [(0, 0)] if poll.questions else []
+    while stack:
+        q_idx, depth = stack.pop()
+        if q_idx in visited:
+            continue
+        visited.add(q_idx)
+        order.append((q_idx, depth))
+        for next_idx in reversed(next_question[q_idx]):
+            if next_idx is not None:
+                stack.append((next_idx, depth + 1))
+    
+    return CompiledPollGraph(answer_index=answer_index, next_question=next_question, order=order)
+
+class FunnelAnalytics:
+    """Инкрементальные счетчики по вершинам и ребрам графа вопросов.
+    
+    Каждый респондент учитывается в вершине один раз, поэтому доходимость,
+    завершение и отток считаются прямо из счетчиков без пересчета ответов.
+    """
+    def __init__(self):
+        self.reached: Dict[int, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.answered: Dict[int, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.edges: Dict[int, Dict[Tuple[int, int], int]] = defaultdict(lambda: defaultdict(int))
+        self.completed: Dict[int, int] = defaultdict(int)
+        self._graphs: Dict[int, CompiledPollGraph] = {}
+    
+    def graph(self, poll_id: int, poll: Poll) -> CompiledPollGraph:
+        if poll_id not in self._graphs:
+            self._graphs[poll_id] = compile_poll_graph(poll)
+        return self._graphs[poll_id]
+    
+    def record_step(self, poll_id: int, poll: Poll, question_idx: int, answer_text: str):
+        graph = self.graph(poll_id, poll)
+        if question_idx >= len(graph.answer_index):
+            return
+        answer_idx = graph.answer_index[question_idx].get(answer_text)
+        if answer_idx is None:
+            return
+        
+        if question_idx == 0:
+            self.reached[poll_id][0] += 1
+        self.answered[poll_id][question_idx] += 1
+        self.edges[poll_id][(question_idx, answer_idx)] += 1
+        
+        next_idx = graph.next_question[question_idx][answer_idx]
+        if next_idx is None:
+            self.completed[poll_id] += 1
+        else:
+            self.reached[poll_id][next_idx] += 1
+    
+    def report(self, poll_id: int, poll: Poll) -> Dict[str, Any]:
+        graph = self.graph(poll_id, poll)
+        reached = self.reached.get(poll_id, {})
+        answered = self.answered.get(poll_id, {})
+        edges = self.edges.get(poll_id, {})
+        started = reached.get(0, 0)
+        completed = self.completed.get(poll_id, 0)
+        
+        nodes = []
+        for q_idx, depth in graph.order:
+            node_reached = reached.get(q_idx, 0)
+            node_answered = answered.get(q_idx, 0)
+            nodes.append({
+                'question': q_idx,
+                'text': poll.questions[q_idx].text,
+                'depth': depth,
+                'reached': node_reached,
+                'answered': node_answered,
+                'dropped': node_reached - node_answered,
+                'reach_rate': node_reached / started if started else 0.0,
+                'drop_off_rate': (node_reached - node_answered) / node_reached if node_reached else 0.0,
+                'answers': [
+                    {
+                        'text': answer.text,
+                        'count': edges.get((q_idx, a_idx), 0),
+                        'next_question': graph.next_question[q_idx][a_idx]
+                    }
+                    for a_idx, answer in enumerate(poll.questions[q_idx].answers)
+                ]
+            })
+        
+        return {
+            'started': started,
+            'completed': completed,
+            'completion_rate': completed / started if started else 0.0,
+            'nodes': nodes
+        }
+    
+    def export_poll(self, poll_id: int) -> Dict[str, Any]:
+        return {
+            'reached': {str(q): n for q, n in self.reached.get(poll_id, {}).items()},
+            'answered': {str(q): n for q, n in self.answered.get(poll_id, {}).items()},
+            'edges': {f"{q}:{a}": n for (q, a), n in self.edges.get(poll_id, {}).items()},
+            'completed': self.completed.get(poll_id, 0)
+        }
+    
+    def import_poll(self, poll_id: int, counters: Dict[str, Any]):
+        for q_str, n in counters.get('reached', {}).items():
+            self.reached[poll_id][int(q_str)] = n
+        for q_str, n in counters.get('answered', {}).items():
+            self.answered[poll_id][int(q_str)] = n
+        for edge, n in counters.get('edges', {}).items():
+            q_str, a_str = edge.split(':')
+            self.edges[poll_id][(int(q_str), int(a_str))] = n
+        self.completed[poll_id] = counters.get('completed', 0)
+    
+    def drop_poll(self, poll_id: int):
+        for counters in (self.reached, self.answered, self.edges, self.completed, self._graphs):
+            counters.pop(poll_id, None)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        poll_ids = set(self.reached) | set(self.answered) | set(self.edges) | set(self.completed)
+        return {str(poll_id): self.export_poll(poll_id) for poll_id in poll_ids}
+    
+    def load_dict(self, data: Dict[str, Any]):
+        for poll_id_str, counters in data.items():
+            self.import_poll(int(poll_id_str), counters)
+
+# Упаковка двоичных данных в снимок
+def pack_bytes(data: bytes) -> str:
+    return base64.b64encode(zlib.compress(data)).decode('ascii')
+
+def unpack_bytes(packed: str) -> bytes:
+    return zlib.decompress(base64.b64decode(packed))
+
+def pack_tree(value: Any) -> Any:
+    """Упаковывает все bytes во вложенных словарях и списках"""
+    if isinstance(value, bytes):
+        return pack_bytes(value)
+    if isinstance(value, dict):
+        return {key: pack_tree(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [pack_tree(item) for item in value]
+    return value
+
+# Колоночное хранилище ответов респондентов
+class ResponseColumns:
+    """Один bytearray на вопрос, строка = респондент (чат, пользователь).
+    
+    В ячейке хранится индекс ответа + 1, 0 означает отсутствие ответа.
+    Фильтры превращаются в битовые маски через bytes.translate и
+    объединяются операциями над целыми числами, так что запросы
+    выполняются целиком на стороне C без цикла по строкам в Python.
+    """
+    MAX_ANSWERS = 254
+    
+    def __init__(self):
+        # {poll_id: {chat_id: {user_id: строка}}}: вложенные словари по чатам заметно
+        # компактнее словаря с ключами-кортежами (чат, пользователь)
+        self.rows: Dict[int, Dict[int, Dict[int, int]]] = {}
+        self.chat_ids: Dict[int, array] = {}
+        self.user_ids: Dict[int, array] = {}
+        self.columns: Dict[int, List[bytearray]] = {}
+    
+    def row_count(self, poll_id: int) -> int:
+        return len(self.chat_ids.get(poll_id, ()))
+    
+    def record(self, poll_id: int, poll: Poll, chat_id: int, user_id: int, question_idx: int, answer_idx: int):
+        if answer_idx >= self.MAX_ANSWERS:
+            return
+        
+        columns = self.columns.get(poll_id)
+        if columns is None:
+            columns = self.columns[poll_id] = [bytearray() for _ in poll.questions]
+            self.rows[poll_id] = {}
+            self.chat_ids[poll_id] = array('q')
+            self.user_ids[poll_id] = array('q')
+        
+        chat_rows = self.rows[poll_id].get(chat_id)
+        if chat_rows is None:
+            chat_rows = self.rows[poll_id][chat_id] = {}
+        row = chat_rows.get(user_id)
+        if row is None:
+            row = len(self.chat_ids[poll_id])
+            chat_rows[user_id] = row
+            self.chat_ids[poll_id].append(chat_id)
+            self.user_ids[poll_id].append(user_id)
+            for column in columns:
+                column.append(0)
+        
+        columns[question_idx][row] = answer_idx + 1
+    
+    def _answer_mask(self, column: bytes, answer_idx: int) -> int:
+        table = bytearray(256)
+        table[answer_idx + 1] = 0xFF
+        return int.from_bytes(column.translate(table), 'little')
+    
+    def _filter_mask(self, poll_id: int, filters: Dict[int, int]) -> Optional[int]:
+        mask = None
+        for question_idx, answer_idx in filters.items():
+            answer_mask = self._answer_mask(self.columns[poll_id][question_idx], answer_idx)
+            mask = answer_mask if mask is None else mask & answer_mask
+        return mask
+    
+    def count(self, poll_id: int, filters: Optional[Dict[int, int]] = None) -> int:
+        """Число респондентов, у которых ответы совпадают со всеми фильтрами {вопрос: ответ}"""
+        if poll_id not in self.columns:
+            return 0
+        mask = self._filter_mask(poll_id, filters or {})
+        if mask is None:
+            return self.row_count(poll_id)
+        return mask.bit_count() // 8
+    
+    def distribution(self, poll_id: int, question_idx: int, num_answers: int,
+                     filters: Optional[Dict[int, int]] = None, mask: Optional[int] = None) -> List[int]:
+        """Распределение ответов на вопрос среди респондентов, прошедших фильтры"""
+        if poll_id not in self.columns:
+            return [0] * num_answers
+        column = bytes(self.columns[poll_id][question_idx])
+        if mask is None:
+            mask = self._filter_mask(poll_id, filters or {})
+        if mask is not None:
+            column = (int.from_bytes(column, 'little') & mask).to_bytes(len(column), 'little')
+        return [column.count(answer_idx + 1) for answer_idx in range(num_answers)]
+    
+    def crosstab(self, poll_id: int, poll: Poll, row_question: int, col_question: int,
+                 filters: Optional[Dict[int, int]] = None) -> List[List[int]]:
+        """Таблица сопряженности: [ответ на row_question][ответ на col_question] -> число респондентов"""
+        row_answers = len(poll.questions[row_question].answers)
+        col_answers = len(poll.questions[col_question].answers)
+        if poll_id not in self.columns:
+            return [[0] * col_answers for _ in range(row_answers)]
+        
+        base_mask = self._filter_mask(poll_id, filters or {})
+        table = []
+        for answer_idx in range(row_answers):
+            mask = self._answer_mask(self.columns[poll_id][row_question], answer_idx)
+            if base_mask is not None:
+                mask &= base_mask
+            table.append(self.distribution(poll_id, col_question, col_answers, mask=mask))
+        return table
+    
+    def snapshot_poll(self, poll_id: int) -> Optional[Dict[str, Any]]:
+        """Копия колонок опроса без упаковки, чтобы сжимать ее вне цикла событий"""
+        if poll_id not in self.columns:
+            return None
+        return {
+            'chat_ids': self.chat_ids[poll_id].tobytes(),
+            'user_ids': self.user_ids[poll_id].tobytes(),
+            'columns': [bytes(column) for column in self.columns[poll_id]]
+        }
+    
+    def export_poll(self, poll_id: int) -> Optional[Dict[str, Any]]:
+        return pack_tree(self.snapshot_poll(poll_id))
+    
+    def import_poll(self, poll_id: int, poll_data: Optional[Dict[str, Any]]):
+        if not poll_data:
+            return
+        
+        chat_ids = array('q')
+        chat_ids.frombytes(unpack_bytes(poll_data['chat_ids']))
+        user_ids = array('q')
+        user_ids.frombytes(unpack_bytes(poll_data['user_ids']))
+        
+        self.chat_ids[poll_id] = chat_ids
+        self.user_ids[poll_id] = user_ids
+        self.columns[poll_id] = [bytearray(unpack_bytes(column)) for column in poll_data['columns']]
+        rows: Dict[int, Dict[int, int]] = {}
+        for row, (chat_id, user_id) in enumerate(zip(chat_ids, user_ids)):
+            chat_rows = rows.get(chat_id)
+            if chat_rows is None:
+                chat_rows = rows[chat_id] = {}
+            chat_rows[user_id] = row
+        self.rows[poll_id] = rows
+    
+    def drop_poll(self, poll_id: int):
+        for storage in (self.rows, self.chat_ids, self.user_ids, self.columns):
+            storage.pop(poll_id, None)
+    
+    def load_dict(self, data: Dict[str, Any]):
+        for poll_id_str, poll_data in data.items():
+            self.import_poll(int(poll_id_str), poll_data)
+
+# Динамика голосов во времени
+ROLLUP_RESOLUTIONS = {
+    'minute': (60, 1440),  # по минутам за последние сутки
+    'hour': (3600, 720),   # по часам за последние 30 дней
+}
+
+class RollupRing:
+    """Кольцевой буфер счетчиков по интервалам с одним маркером head - номером последнего интервала записи.
+    
+    При переходе к новому интервалу обнуляются только ячейки пропущенных интервалов,
+    поэтому запись голоса в среднем стоит O(1), а номер интервала не хранится в каждой ячейке.
+    """
+    __slots__ = ('counts', 'head')
+    
+    def __init__(self, size: int, counts: Optional[array] = None, head: int = -1):
+        self.counts = counts if counts is not None else array('I', [0]) * size
+        self.head = head
+    
+    def add(self, bucket: int):
+        size = len(self.counts)
+        if bucket > self.head:
+            if bucket - self.head >= size:
+                self.counts = array('I', [0]) * size
+            else:
+                for skipped in range(self.head + 1, bucket + 1):
+                    self.counts[skipped % size] = 0
+            self.head = bucket
+        elif bucket <= self.head - size:
+            # Интервал уже вышел из окна
+            return
+        self.counts[bucket % size] += 1
+    
+    def series(self, current: int) -> List[int]:
+        """Счетчики интервалов current - size + 1 ... current"""
+        size = len(self.counts)
+        return [
+            self.counts[bucket % size] if self.head - size < bucket <= self.head else 0
+            for bucket in range(current - size + 1, current + 1)
+        ]
+
+class VoteRollup:
+    """Кольцевые буферы числа голосов по каждому ответу: по минутам за сутки и по часам за 30 дней"""
+    def __init__(self):
+        # {poll_id: {(вопрос, ответ): {разрешение: кольцо}}}
+        self.series: Dict[int, Dict[Tuple[int, int], Dict[str, RollupRing]]] = {}
+    
+    def record(self, poll_id: int, question_idx: int, answer_idx: int, ts: Optional[float] = None):
+        ts = time.time() if ts is None else ts
+        answers = self.series.setdefault(poll_id, {})
+        rings = answers.get((question_idx, answer_idx))
+        if rings is None:
+            rings = answers[(question_idx, answer_idx)] = {
+                resolution: RollupRing(size) for resolution, (_, size) in ROLLUP_RESOLUTIONS.items()
+            }
+        
+        for resolution, (step, _) in ROLLUP_RESOLUTIONS.items():
+            rings[resolution].add(int(ts // step))
+    
+    def answer_series(self, poll_id: int, question_idx: int, answer_idx: int, resolution: str,
+                      now: Optional[float] = None) -> List[int]:
+        """Счетчики по интервалам от самого старого к текущему"""
+        step, size = ROLLUP_RESOLUTIONS[resolution]
+        rings = self.series.get(poll_id, {}).get((question_idx, answer_idx))
+        if rings is None:
+            return [0] * size
+        return rings[resolution].series(int((time.time() if now is None else now) // step))
+    
+    def totals(self, poll_id: int, resolution: str, now: Optional[float] = None) -> List[int]:
+        _, size = ROLLUP_RESOLUTIONS[resolution]
+        totals = [0] * size
+        for question_idx, answer_idx in self.series.get(poll_id, {}):
+            for i, count in enumerate(self.answer_series(poll_id, question_idx, answer_idx, resolution, now)):
+                totals[i] += count
+        return totals
+    
+    def snapshot_poll(self, poll_id: int) -> Dict[str, Any]:
+        """Копия буферов опроса без упаковки, чтобы сжимать ее вне цикла событий"""
+        return {
+            f"{q}:{a}": {
+                resolution: {'counts': ring.counts.tobytes(), 'head': ring.head}
+                for resolution, ring in rings.items()
+            }
+            for (q, a), rings in self.series.get(poll_id, {}).items()
+        }
+    
+    def export_poll(self, poll_id: int) -> Dict[str, Any]:
+        return pack_tree(self.snapshot_poll(poll_id))
+    
+    def import_poll(self, poll_id: int, data: Dict[str, Any]):
+        for key, resolutions in data.items():
+            q_str, a_str = key.split(':')
+            rings = {resolution: RollupRing(size) for resolution, (_, size) in ROLLUP_RESOLUTIONS.items()}
+            for resolution, packed in resolutions.items():
+                if resolution not in ROLLUP_RESOLUTIONS:
+                    continue
+                _, size = ROLLUP_RESOLUTIONS[resolution]
+                counts = array('I')
+                counts.frombytes(unpack_bytes(packed['counts']))
+                if 'head' in packed:
+                    head = packed['head']
+                else:
+                    # Старый формат хранил номер интервала в каждой ячейке
+                    buckets = array('q')
+                    buckets.frombytes(unpack_bytes(packed['buckets']))
+                    head = max(buckets)
+                    for slot, bucket in enumerate(buckets):
+                        if bucket <= head - size:
+                            counts[slot] = 0
+                rings[resolution] = RollupRing(size, counts, head)
+            self.series.setdefault(poll_id, {})[(int(q_str), int(a_str))] = rings
+    
+    def drop_poll(self, poll_id: int):
+        self.series.pop(poll_id, None)
+    
+    def load_dict(self, data: Dict[str, Any]):
+        for poll_id_str, poll_data in data.items():
+            self.import_poll(int(poll_id_str), poll_data)
+
+# Сериализация опросов
+def poll_to_dict(poll: Poll) -> Dict[str, Any]:
+    return {
+        'name': poll.name,
+        'created_by': poll.created_by,
+        'created_at': poll.created_at,
+        'questions': [
+            {
+                'text': q.text,
+                'level': q.level,
+                'answers': [
+                    {
+                        'text': a.text,
+                        'next_question': a.next_question,
+                        'level': a.level
+                    }
+                    for a in q.answers
+                ]
+            }
+            for q in poll.questions
+        ]
+    }
+
+def poll_from_dict(poll_data: Dict[str, Any]) -> Poll:
+    questions = []
+    for q_data in poll_data['questions']:
+        answers = [
+            Answer(
+                text=a_data['text'],
+                next_question=a_data['next_question'],
+                level=a_data['level']
+            )
+            for a_data in q_data['answers']
+        ]
+        
+        questions.append(
+            Question(
+                text=q_data['text'],
+                answers=answers,
+                level=q_data['level']
+            )
+        )
+    
+    return Poll(
+        name=poll_data['name'],
+        questions=questions,
+        created_by=poll_data['created_by'],
+        created_at=poll_data.get('created_at', datetime.now().isoformat())
+    )
 
 # Хранилище данных
 class PollStorage:
@@ -80,70 +947,263 @@ class PollStorage:
         self.poll_results: Dict[int, Dict[int, Dict[str, int]]] = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
         self.user_progress: Dict[int, Dict[int, Dict[str, Any]]] = {}
         self.active_polls: Dict[int, int] = {}  # {chat_id: poll_id}
+        self.poll_activity: Dict[int, float] = {}  # {poll_id: время последнего ответа}
+        self.poll_index = AdminPollIndex()
+        self.funnel = FunnelAnalytics()
+        self.responses = ResponseColumns()
+        self.rollups = VoteRollup()
+        self.archived: Dict[int, str] = {}  # {poll_id: название} опросов в холодном архиве
+        self.analytics_dirty: Set[int] = set()  # опросы, чьи файлы аналитики устарели
+        self.load_failed = False  # после неудачной загрузки сохранение затерло бы файл неполными данными
+        self._save_lock = threading.Lock()
+        self._snapshot_seq = 0
+        self._saved_seq = 0
     
     def add_poll(self, admin_id: int, poll: Poll) -> int:
         poll_id = self.poll_id_counter
         self.poll_id_counter += 1
         self.polls[poll_id] = poll
         self.admin_polls[admin_id].append(poll_id)
+        self.poll_activity[poll_id] = time.time()
+        self.poll_index.add(admin_id, poll_id, poll.name, self.poll_activity[poll_id])
         return poll_id
     
     def get_poll(self, poll_id: int) -> Optional[Poll]:
+        """Опрос из памяти; архивные опросы поднимает load_poll()"""
         return self.polls.get(poll_id)
     
-    def record_answer(self, poll_id: int, question_idx: int, answer_text: str):
-        self.poll_results[poll_id][question_idx][answer_text] += 1
+    def get_poll_name(self, poll_id: int) -> Optional[str]:
+        """Название опроса без загрузки его из архива"""
+        poll = self.polls.get(poll_id)
+        return poll.name if poll else self.archived.get(poll_id)
+    
+    def is_archived(self, poll_id: int) -> bool:
+        return poll_id in self.archived
+    
+    def archive_path(self, poll_id: int) -> str:
+        return os.path.join(ARCHIVE_DIR, f"poll_{poll_id}.json.gz")
+    
+    def archive_candidates(self, max_idle_seconds: float) -> List[int]:
+        """Опросы без ответов дольше max_idle_seconds, кроме идущих в чатах"""
+        now = time.time()
+        running = set(self.active_polls.values())
+        return [
+            poll_id for poll_id in self.polls
+            if poll_id not in running and now - self.poll_activity.get(poll_id, now) >= max_idle_seconds
+        ]
+    
+    def archive_snapshot(self, poll_id: int) -> Dict[str, Any]:
+        """Копия опроса со всеми результатами для архива; упаковка и запись - в write_archive"""
+        poll = self.polls[poll_id]
+        return {
+            'poll': poll_to_dict(poll),
+            'results': {
+                str(q_idx): dict(answers)
+                for q_idx, answers in self.poll_results.get(poll_id, {}).items()
+            },
+            'funnel': self.funnel.export_poll(poll_id),
+            'responses': self.responses.snapshot_poll(poll_id),
+            'rollups': self.rollups.snapshot_poll(poll_id)
+        }
+    
+    def write_archive(self, poll_id: int, snapshot: Dict[str, Any]):
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        path = self.archive_path(poll_id)
+        with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as f:
+            json.dump(pack_tree(snapshot), f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+    
+    def drop_archived(self, poll_id: int):
+        """Убирает из памяти опрос, уже записанный в архив"""
+        # Файл аналитики больше не нужен: все данные опроса теперь в архиве
+        try:
+            os.remove(self.analytics_path(poll_id))
+        except FileNotFoundError:
+            pass
+        self.analytics_dirty.discard(poll_id)
+        
+        self.archived[poll_id] = self.polls.pop(poll_id).name
+        self.poll_results.pop(poll_id, None)
+        self.funnel.drop_poll(poll_id)
+        self.responses.drop_poll(poll_id)
+        self.rollups.drop_poll(poll_id)
     
-    def save_to_file(self, filename: str = 'poll_data.json'):
+    def read_archive(self, poll_id: int) -> Optional[Dict[str, Any]]:
         try:
-            data = {
-                'polls': {},
-                'poll_id_counter': self.poll_id_counter,
-                'admin_polls': {str(k): v for k, v in self.admin_polls.items()},
-                'poll_results': {
-                    str(poll_id): {
-                        str(q_idx): dict(answers) 
-                        for q_idx, answers in questions.items()
-                    } 
-                    for poll_id, questions in self.poll_results.items()
-                }
+            with gzip.open(self.archive_path(poll_id), 'rt', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки опроса {poll_id} из архива: {e}")
+            return None
+    
+    def restore_poll(self, poll_id: int, payload: Dict[str, Any]) -> Poll:
+        """Возвращает в память опрос, прочитанный из архива через read_archive"""
+        if poll_id in self.polls:
+            # Опрос уже поднял параллельный запрос
+            return self.polls[poll_id]
+        
+        poll = poll_from_dict(payload['poll'])
+        self.polls[poll_id] = poll
+        for q_idx_str, answers in payload.get('results', {}).items():
+            for answer, count in answers.items():
+                self.poll_results[poll_id][int(q_idx_str)][answer] = count
+        self.funnel.import_poll(poll_id, payload.get('funnel', {}))
+        self.responses.import_poll(poll_id, payload.get('responses'))
+        self.rollups.import_poll(poll_id, payload.get('rollups', {}))
+        self.analytics_dirty.add(poll_id)
+        # Файл архива остается до следующей архивации: снимок на диске еще может не содержать опрос
+        del self.archived[poll_id]
+        
+        logger.info(f"Опрос {poll_id} загружен из архива")
+        return poll
+    
+    def analytics_path(self, poll_id: int) -> str:
+        return os.path.join(ANALYTICS_DIR, f"poll_{poll_id}.json")
+    
+    def collect_dirty_analytics(self) -> Dict[int, Dict[str, Any]]:
+        """Копирует аналитику измененных опросов; вызывается из цикла событий, упаковка - в write_analytics"""
+        if self.load_failed:
+            return {}
+        snapshots = {
+            poll_id: {
+                'responses': self.responses.snapshot_poll(poll_id),
+                'rollups': self.rollups.snapshot_poll(poll_id)
             }
+            for poll_id in self.analytics_dirty if poll_id in self.polls
+        }
+        self.analytics_dirty.clear()
+        return snapshots
+    
+    def write_analytics(self, snapshots: Dict[int, Dict[str, Any]]) -> List[int]:
+        """Пишет файлы аналитики опросов, возвращает опросы, которые записать не удалось"""
+        os.makedirs(ANALYTICS_DIR, exist_ok=True)
+        failed = []
+        for poll_id, snapshot in snapshots.items():
+            path = self.analytics_path(poll_id)
+            try:
+                with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                    json.dump(pack_tree(snapshot), f)
+                os.replace(path + '.tmp', path)
+            except Exception as e:
+                logger.error(f"Ошибка сохранения аналитики опроса {poll_id}: {e}")
+                failed.append(poll_id)
+        return failed
+    
+    def load_analytics(self):
+        if not os.path.isdir(ANALYTICS_DIR):
+            return
+        for name in os.listdir(ANALYTICS_DIR):
+            poll_id_str = name.removeprefix('poll_').removesuffix('.json')
+            if not name.endswith('.json') or not poll_id_str.isdigit():
+                continue
+            poll_id = int(poll_id_str)
+            # Файлы архивных опросов могли остаться после сбоя, их данные берутся из архива
+            if poll_id not in self.polls:
+                continue
+            path = os.path.join(ANALYTICS_DIR, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    payload = json.load(f)
+                self.responses.import_poll(poll_id, payload.get('responses'))
+                self.rollups.import_poll(poll_id, payload.get('rollups', {}))
+            except Exception as e:
+                # Аналитика производная: без нее опрос работает, поэтому загрузку данных не срываем.
+                # Файл откладываем в сторону, чтобы следующий сброс его не перезаписал
+                logger.error(f"Ошибка загрузки аналитики опроса {poll_id}, она пропущена: {e}")
+                self.responses.drop_poll(poll_id)
+                self.rollups.drop_poll(poll_id)
+                try:
+                    os.replace(path, path + '.broken')
+                except OSError:
+                    pass
+    
+    def record_answer(self, poll_id: int, question_idx: int, answer_text: str, first_time: bool = True,
+                      respondent: Optional[Tuple[int, int]] = None):
+        self.poll_results[poll_id][question_idx][answer_text] += 1
+        
+        poll = self.polls.get(poll_id)
+        if poll:
+            # В воронке каждый респондент учитывается на вопросе только один раз
+            if first_time:
+                self.funnel.record_step(poll_id, poll, question_idx, answer_text)
             
-            # Преобразуем опросы в словари для сериализации
-            for poll_id, poll in self.polls.items():
-                data['polls'][str(poll_id)] = {
-                    'name': poll.name,
-                    'created_by': poll.created_by,
-                    'created_at': poll.created_at,
-                    'questions': [
-                        {
-                            'text': q.text,
-                            'level': q.level,
-                            'answers': [
-                                {
-                                    'text': a.text,
-                                    'next_question': a.next_question,
-                                    'level': a.level
-                                }
-                                for a in q.answers
-                            ]
-                        }
-                        for q in poll.questions
-                    ]
-                }
-            
-            with open(filename, 'w', encoding='utf-8') as f:
+            answer_idx = self.funnel.graph(poll_id, poll).answer_index[question_idx].get(answer_text)
+            if answer_idx is not None:
+                self.rollups.record(poll_id, question_idx, answer_idx)
+                self.analytics_dirty.add(poll_id)
+            if respondent is not None and answer_idx is not None:
+                chat_id, user_id = respondent
+                self.responses.record(poll_id, poll, chat_id, user_id, question_idx, answer_idx)
+                self.analytics_dirty.add(poll_id)
+            self.poll_activity[poll_id] = time.time()
+            self.poll_index.touch(poll.created_by, poll_id, self.poll_activity[poll_id])
+    
+    def rebuild_index(self):
+        self.poll_index = AdminPollIndex()
+        for admin_id, poll_ids in self.admin_polls.items():
+            for poll_id in poll_ids:
+                poll = self.polls.get(poll_id)
+                name = poll.name if poll else self.archived.get(poll_id)
+                if name is None:
+                    continue
+                if poll_id not in self.poll_activity:
+                    try:
+                        self.poll_activity[poll_id] = datetime.fromisoformat(poll.created_at).timestamp() if poll else 0.0
+                    except ValueError:
+                        self.poll_activity[poll_id] = 0.0
+                self.poll_index.add(admin_id, poll_id, name, self.poll_activity[poll_id])
+    
+    def snapshot(self) -> Tuple[int, Dict[str, Any]]:
+        """Собирает данные для сохранения в цикле событий; запись на диск - в write_snapshot"""
+        data = {
+            'polls': {},
+            'poll_id_counter': self.poll_id_counter,
+            'admin_polls': {str(k): list(v) for k, v in self.admin_polls.items()},
+            'poll_results': {
+                str(poll_id): {
+                    str(q_idx): dict(answers) 
+                    for q_idx, answers in questions.items()
+                } 
+                for poll_id, questions in self.poll_results.items()
+            },
+            'poll_activity': {str(k): v for k, v in self.poll_activity.items()},
+            'funnel': self.funnel.to_dict(),
+            'archived': {str(k): v for k, v in self.archived.items()}
+        }
+        
+        # Преобразуем опросы в словари для сериализации
+        for poll_id, poll in self.polls.items():
+            data['polls'][str(poll_id)] = poll_to_dict(poll)
+        
+        self._snapshot_seq += 1
+        return self._snapshot_seq, data
+    
+    def write_snapshot(self, seq: int, data: Dict[str, Any], filename: str = DATA_FILE):
+        # Снимки пишутся и из цикла событий, и из потоков: более старый не должен затереть более новый
+        with self._save_lock:
+            if seq <= self._saved_seq:
+                return
+            with open(filename + '.tmp', 'w', encoding='utf-8') as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
-            
-            logger.info("Данные успешно сохранены")
+            os.replace(filename + '.tmp', filename)
+            self._saved_seq = seq
+        
+        logger.info("Данные успешно сохранены", extra={'sample': True})
+    
+    def save_to_file(self, filename: str = DATA_FILE):
+        if self.load_failed:
+            logger.error("Сохранение отключено: данные не были загружены")
+            return
+        try:
+            self.write_snapshot(*self.snapshot(), filename)
         except Exception as e:
             logger.error(f"Ошибка сохранения данных: {e}")
     
-    def load_from_file(self, filename: str = 'poll_data.json'):
+    def load_from_file(self, filename: str = DATA_FILE) -> bool:
         try:
             if not os.path.exists(filename):
                 logger.info("Файл данных не найден, создаем пустое хранилище")
-                return
+                return True
             
             with open(filename, 'r', encoding='utf-8') as f:
                 data = json.load(f)
@@ -164,62 +1224,487 @@ class PollStorage:
                     for answer, count in answers.items():
                         self.poll_results[poll_id][q_idx][answer] = count
             
+            # Загружаем счетчики воронки
+            self.funnel.load_dict(data.get('funnel', {}))
+            
             # Загружаем сами опросы
             polls_data = data.get('polls', {})
             for poll_id_str, poll_data in polls_data.items():
-                poll_id = int(poll_id_str)
-                
-                questions = []
-                for q_data in poll_data['questions']:
-                    answers = [
-                        Answer(
-                            text=a_data['text'],
-                            next_question=a_data['next_question'],
-                            level=a_data['level']
-                        )
-                        for a_data in q_data['answers']
-                    ]
-                    
-                    questions.append(
-                        Question(
-                            text=q_data['text'],
-                            answers=answers,
-                            level=q_data['level']
-                        )
-                    )
-                
-                poll = Poll(
-                    name=poll_data['name'],
-                    questions=questions,
-                    created_by=poll_data['created_by'],
-                    created_at=poll_data.get('created_at', __import__('datetime').datetime.now().isoformat())
-                )
-                
-                self.polls[poll_id] = poll
+                self.polls[int(poll_id_str)] = poll_from_dict(poll_data)
+            
+            # Колонки ответов и динамика лежат в файлах по опросам; старые снимки хранили их внутри себя
+            self.load_analytics()
+            legacy_responses = {
+                poll_id_str: poll_data for poll_id_str, poll_data in data.get('responses', {}).items()
+                if int(poll_id_str) not in self.responses.columns
+            }
+            self.responses.load_dict(legacy_responses)
+            self.analytics_dirty.update(int(poll_id_str) for poll_id_str in legacy_responses)
+            legacy_rollups = {
+                poll_id_str: poll_data for poll_id_str, poll_data in data.get('rollups', {}).items()
+                if int(poll_id_str) in self.polls and int(poll_id_str) not in self.rollups.series
+            }
+            self.rollups.load_dict(legacy_rollups)
+            self.analytics_dirty.update(int(poll_id_str) for poll_id_str in legacy_rollups)
+            
+            # Опросы в холодном архиве загружаются по требованию
+            for poll_id_str, name in data.get('archived', {}).items():
+                self.archived[int(poll_id_str)] = name
+            
+            # Загружаем время последней активности и строим индекс
+            for poll_id_str, activity in data.get('poll_activity', {}).items():
+                self.poll_activity[int(poll_id_str)] = activity
+            self.rebuild_index()
             
             logger.info("Данные успешно загружены")
+            return True
         except Exception as e:
             logger.error(f"Ошибка загрузки данных: {e}")
+            self.load_failed = True
+            return False
 
 # Инициализируем хранилище
 storage_manager = PollStorage()
 
+async def load_poll(poll_id: int) -> Optional[Poll]:
+    """Опрос из памяти или из холодного архива; файл архива читается в отдельном потоке"""
+    poll = storage_manager.get_poll(poll_id)
+    if poll is None and storage_manager.is_archived(poll_id):
+        payload = await asyncio.to_thread(storage_manager.read_archive, poll_id)
+        if payload is not None:
+            poll = storage_manager.restore_poll(poll_id, payload)
+    return poll
+
+async def save_data():
+    """Сохранение без блокировки цикла событий: снимок собирается здесь, пишется в отдельном потоке"""
+    if storage_manager.load_failed:
+        logger.error("Сохранение отключено: данные не были загружены")
+        return
+    try:
+        seq, data = storage_manager.snapshot()
+        await asyncio.to_thread(storage_manager.write_snapshot, seq, data)
+    except Exception as e:
+        logger.error(f"Ошибка сохранения данных: {e}")
+
+# Отрисовка структуры опроса
+MESSAGE_PAGE_LIMIT = 3500  # запас до лимита Telegram в 4096 символов под заголовок и разметку
+DOCUMENT_PAGE_THRESHOLD = 20  # начиная с этого числа страниц структура отправляется файлом
+
+@dataclass
+class RenderedPoll:
+    pages: List[str]
+    document: bytes
+
+def render_poll_tree(poll: Poll) -> List[Tuple[int, bool, str]]:
+    """Обходит дерево опроса в глубину и возвращает строки (глубина, это_вопрос, текст)"""
+    lines = []
+    visited = set()
+    stack: List[Tuple[int, bool, Any]] = [(0, True, 0)]
+    
+    while stack:
+        depth, is_question, item = stack.pop()
+        if is_question:
+            if item in visited or item >= len(poll.questions):
+                continue
+            visited.add(item)
+            question = poll.questions[item]
+            lines.append((depth, True, question.text))
+            for answer in reversed(question.answers):
+                stack.append((depth, False, answer))
+        else:
+            lines.append((depth, False, item.text))
+            if item.next_question is not None:
+                stack.append((depth + 1, True, item.next_question))
+    
+    return lines
+
+def split_into_pages(lines: List[str], limit: int = MESSAGE_PAGE_LIMIT) -> List[str]:
+    pages = []
+    current = []
+    current_len = 0
+    for line in lines:
+        if current and current_len + len(line) + 1 > limit:
+            pages.append('\n'.join(current))
+            current = []
+            current_len = 0
+        current.append(line)
+        current_len += len(line) + 1
+    if current:
+        pages.append('\n'.join(current))
+    return pages or ['']
+
+class PollRenderCache:
+    """LRU-кэш отрисованной структуры опросов: дерево строится один раз на опрос"""
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._cache: OrderedDict[int, RenderedPoll] = OrderedDict()
+    
+    def get(self, poll_id: int, poll: Poll) -> RenderedPoll:
+        rendered = self._cache.get(poll_id)
+        if rendered is not None:
+            self._cache.move_to_end(poll_id)
+            return rendered
+        
+        tree = render_poll_tree(poll)
+        html_lines = []
+        text_lines = []
+        for depth, is_question, text in tree:
+            indent = '    ' * depth
+            if is_question:
+                html_lines.append(f"{indent}<b>❓ {html.escape(text)}</b>")
+                text_lines.append(f"{indent}? {text}")
+            else:
+                html_lines.append(f"{indent}  • {html.escape(text)}")
+                text_lines.append(f"{indent}  - {text}")
+        
+        rendered = RenderedPoll(
+            pages=split_into_pages(html_lines),
+            document='\n'.join([poll.name, ''] + text_lines).encode('utf-8')
+        )
+        self._cache[poll_id] = rendered
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return rendered
+
+poll_render_cache = PollRenderCache()
+
+# Кэш статусов участников чатов для проверки прав администратора
+CHAT_MEMBER_CACHE_TTL = float(os.environ.get('CHAT_MEMBER_CACHE_TTL', 300))
+
+class ChatMemberCache:
+    """TTL-кэш get_chat_member по ключу (chat_id, user_id).
+    
+    Одновременные запросы одного и того же участника объединяются в один
+    вызов API, а обновления chat_member сразу заменяют закэшированный статус.
+    """
+    def __init__(self, ttl: float = CHAT_MEMBER_CACHE_TTL, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._cache: OrderedDict[Tuple[int, int], Tuple[float, ChatMember]] = OrderedDict()
+        self._pending: Dict[Tuple[int, int], asyncio.Task] = {}
+    
+    def set(self, chat_id: int, user_id: int, member: ChatMember):
+        key = (chat_id, user_id)
+        self._cache[key] = (time.monotonic() + self.ttl, member)
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+    
+    def invalidate(self, chat_id: int, user_id: int):
+        self._cache.pop((chat_id, user_id), None)
+    
+    async def _fetch(self, bot: Bot, chat_id: int, user_id: int) -> ChatMember:
+        member = await bot.get_chat_member(chat_id, user_id)
+        self.set(chat_id, user_id, member)
+        return member
+    
+    async def get(self, bot: Bot, chat_id: int, user_id: int) -> ChatMember:
+        key = (chat_id, user_id)
+        cached = self._cache.get(key)
+        if cached is not None:
+            expires_at, member = cached
+            if expires_at > time.monotonic():
+                return member
+            del self._cache[key]
+        
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(bot, chat_id, user_id))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        return await asyncio.shield(task)
+    
+    async def is_admin(self, bot: Bot, chat_id: int, user_id: int) -> bool:
+        member = await self.get(bot, chat_id, user_id)
+        return member.status in (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.CREATOR)
+
+chat_member_cache = ChatMemberCache()
+
 class PollCreationStates(StatesGroup):
     awaiting_poll_name = State()
     awaiting_poll_structure = State()
+    awaiting_import_file = State()
+
+class PollSearchStates(StatesGroup):
+    awaiting_name_prefix = State()
+
+# Учет обрабатываемых обновлений для корректного завершения
+class InFlightTracker:
+    def __init__(self):
+        self.accepting = True
+        self.count = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+    
+    async def __call__(self, handler, event: Update, data: Dict[str, Any]):
+        if not self.accepting:
+            return None
+        self.count += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.count -= 1
+            if self.count == 0:
+                self._idle.set()
+    
+    async def wait_idle(self):
+        await self._idle.wait()
+
+in_flight = InFlightTracker()
+dp.update.outer_middleware(in_flight)
+
+# Нагрузка для сброса: только обновления, прошедшие ожидание загрузки данных (регистрируется после wait_for_data_middleware)
+handler_load = InFlightTracker()
+
+# Функции сброса отложенных данных, вызываются при остановке после сохранения хранилища
+shutdown_hooks: List[Callable[[], Awaitable[None]]] = []
+
+def register_shutdown_hook(hook: Callable[[], Awaitable[None]]):
+    shutdown_hooks.append(hook)
+    return hook
 
-def signal_handler(signum, frame):
+# Запрос остановки; polling останавливает handle_updates(), даже если сигнал пришел до его запуска
+stop_requested = asyncio.Event()
+
+def signal_handler(signum: int):
     global bot_instance_running
     logger.info(f"Получен сигнал {signum}, завершаем работу...")
     bot_instance_running = False
-    asyncio.create_task(shutdown())
+    # Прием обновлений закрывается в shutdown(): уже полученные от Telegram обновления
+    # подтверждены смещением и должны быть обработаны, а не отброшены
+    stop_requested.set()
+
+async def stop_polling():
+    try:
+        await dp.stop_polling()
+    except RuntimeError:
+        # polling еще не запущен или уже остановлен
+        pass
 
 async def shutdown():
+    """Останавливает прием обновлений, дожидается обработчиков, сбрасывает данные и закрывает сессию"""
     logger.info("Завершение работы бота...")
+    # Задачи, созданные polling для последней пачки обновлений, успевают войти в in_flight
+    await asyncio.sleep(0)
+    in_flight.accepting = False
+    deadline = time.monotonic() + SHUTDOWN_DRAIN_TIMEOUT
+    
+    def remaining() -> float:
+        return max(0.0, deadline - time.monotonic())
+    
+    try:
+        await asyncio.wait_for(in_flight.wait_idle(), remaining())
+    except asyncio.TimeoutError:
+        logger.warning(f"Не дождались завершения обработчиков: {in_flight.count} еще выполняются")
+    
+    # Пока данные не загружены, сохранение затерло бы файл пустым хранилищем
+    if data_ready.is_set():
+        try:
+            await asyncio.wait_for(save_data(), remaining())
+        except asyncio.TimeoutError:
+            logger.error("Не успели сохранить данные до истечения срока остановки")
+    
+    for hook in shutdown_hooks:
+        try:
+            await asyncio.wait_for(hook(), remaining())
+        except asyncio.TimeoutError:
+            logger.error(f"Не успели выполнить {hook.__name__} до истечения срока остановки")
+        except Exception as e:
+            logger.error(f"Ошибка при выполнении {hook.__name__}: {e}")
+    
     await bot.session.close()
-    storage_manager.save_to_file()
     logger.info("Бот успешно завершил работу")
 
+# Ограничение частоты callback-запросов и сброс нагрузки
+class TokenBucketLimiter:
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._prune_at = max_keys
+        self._buckets: Dict[int, Tuple[float, float]] = {}  # {ключ: (токены, время обновления)}
+    
+    def _tokens(self, key: int, now: float) -> float:
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.rate)
+    
+    def available(self, key: int, now: float) -> bool:
+        """Есть ли токен, без списания: проверка нескольких корзин не должна тратить токены при отказе"""
+        return self._tokens(key, now) >= 1
+    
+    def consume(self, key: int, now: float):
+        self._buckets[key] = (self._tokens(key, now) - 1, now)
+        if len(self._buckets) > self._prune_at:
+            self._prune(now)
+    
+    def _prune(self, now: float):
+        # Полностью восстановившиеся корзины ничем не отличаются от отсутствующих
+        self._buckets = {
+            key: (tokens, updated)
+            for key, (tokens, updated) in self._buckets.items()
+            if tokens + (now - updated) * self.rate < self.burst
+        }
+        # Если активных корзин все еще много, откладываем следующую очистку, чтобы она не шла на каждый запрос
+        self._prune_at = max(self.max_keys, 2 * len(self._buckets))
+
+class ThrottlingMiddleware:
+    """Отсекает лишние нажатия до обработчиков: на них отвечаем коротким уведомлением"""
+    def __init__(self, tracker: InFlightTracker):
+        self.tracker = tracker
+        self.user_limiter = TokenBucketLimiter(THROTTLE_USER_RATE, THROTTLE_USER_BURST)
+        self.chat_limiter = TokenBucketLimiter(THROTTLE_CHAT_RATE, THROTTLE_CHAT_BURST)
+        self.shedding = False
+        self.throttled = 0
+        self.shed = 0
+    
+    def update_shedding(self):
+        load = self.tracker.count
+        if self.shedding and load <= LOAD_SHED_LOW_WATERMARK:
+            self.shedding = False
+            logger.info(f"Нагрузка снизилась ({load}), сброс нагрузки выключен")
+        elif not self.shedding and load >= LOAD_SHED_HIGH_WATERMARK:
+            self.shedding = True
+            logger.warning(f"Слишком много обрабатываемых обновлений ({load}), включен сброс нагрузки")
+    
+    async def reject(self, callback: CallbackQuery, text: Optional[str] = None):
+        try:
+            await callback.answer(text)
+        except TelegramAPIError:
+            pass
+    
+    async def __call__(self, handler, event: CallbackQuery, data: Dict[str, Any]):
+        self.update_shedding()
+        if self.shedding:
+            self.shed += 1
+            await self.reject(event, "Бот перегружен, попробуйте через несколько секунд")
+            return None
+        
+        now = time.monotonic()
+        user_id = event.from_user.id
+        chat_id = event.message.chat.id if event.message else user_id
+        if not self.user_limiter.available(user_id, now) or not self.chat_limiter.available(chat_id, now):
+            self.throttled += 1
+            await self.reject(event, "Слишком много нажатий, попробуйте еще раз через секунду")
+            return None
+        self.user_limiter.consume(user_id, now)
+        self.chat_limiter.consume(chat_id, now)
+        
+        return await handler(event, data)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'callbacks_throttled': self.throttled,
+            'callbacks_shed': self.shed,
+            'load_shedding': self.shedding,
+            'updates_in_flight': self.tracker.count,
+        }
+
+callback_throttle = ThrottlingMiddleware(handler_load)
+dp.callback_query.outer_middleware(callback_throttle)
+
+# Запись обновлений в сжатый NDJSON
+class UpdateRecorder:
+    """Пишет каждое входящее обновление строкой {"t": время, "update": ...} в gzip-файл"""
+    PERSONAL_KEYS = ('username', 'last_name', 'phone_number', 'bio')
+    
+    def __init__(self, path: str, anonymize: bool = True, salt: str = '',
+                 flush_every: int = UPDATE_RECORD_FLUSH_EVERY, flush_interval: float = UPDATE_RECORD_FLUSH_INTERVAL):
+        self.path = path
+        self.anonymize = anonymize
+        self.salt = salt.encode()
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.recorded = 0
+        self._unflushed = 0
+        self._flushed_at = time.monotonic()
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+    
+    def pseudo_id(self, real_id: int) -> int:
+        # Одинаковые id всегда дают одинаковый псевдоним, знак (пользователь/группа) сохраняется
+        digest = hmac.new(self.salt, str(abs(real_id)).encode(), hashlib.sha256).hexdigest()
+        pseudo = int(digest[:12], 16) % 10 ** 10 + 1
+        return -pseudo if real_id < 0 else pseudo
+    
+    def anonymize_payload(self, payload: Any) -> Any:
+        if isinstance(payload, list):
+            return [self.anonymize_payload(item) for item in payload]
+        if not isinstance(payload, dict):
+            return payload
+        
+        result = {}
+        for key, value in payload.items():
+            if key in self.PERSONAL_KEYS:
+                continue
+            if key in ('id', 'user_id', 'chat_id') and isinstance(value, int) and value != bot.id:
+                result[key] = self.pseudo_id(value)
+            elif key == 'first_name':
+                result[key] = 'User'
+            else:
+                result[key] = self.anonymize_payload(value)
+        return result
+    
+    async def __call__(self, handler, event: Update, data: Dict[str, Any]):
+        try:
+            payload = event.model_dump(mode='json', exclude_none=True, by_alias=True)
+            if self.anonymize:
+                payload = self.anonymize_payload(payload)
+            self._file.write(json.dumps({'t': time.time(), 'update': payload}, ensure_ascii=False) + '\n')
+            self.recorded += 1
+            self._unflushed += 1
+            if self._unflushed >= self.flush_every or time.monotonic() - self._flushed_at >= self.flush_interval:
+                self.flush()
+        except Exception as e:
+            logger.error(f"Ошибка записи обновления: {e}")
+        return await handler(event, data)
+    
+    def flush(self):
+        # GzipFile.flush делает Z_SYNC_FLUSH: все записанные строки читаются и без конца gzip-потока
+        self._file.flush()
+        self._unflushed = 0
+        self._flushed_at = time.monotonic()
+    
+    async def close(self):
+        self._file.close()
+        logger.info(f"Записано обновлений: {self.recorded} в {self.path}")
+
+if UPDATE_RECORD_PATH:
+    update_recorder = UpdateRecorder(UPDATE_RECORD_PATH, UPDATE_RECORD_ANONYMIZE, UPDATE_RECORD_SALT)
+    dp.update.outer_middleware(update_recorder)
+    register_shutdown_hook(update_recorder.close)
+
+# Готовность данных: HTTP-сервер стартует сразу, данные грузятся в фоне
+data_ready = asyncio.Event()
+
+def log_phase(name: str, started: float):
+    logger.info(f"Фаза запуска «{name}» заняла {time.perf_counter() - started:.3f} сек.")
+
+async def load_data():
+    """Фоновая загрузка данных в отдельном потоке"""
+    started = time.perf_counter()
+    if not await asyncio.to_thread(storage_manager.load_from_file):
+        # /ready остается 503, обновления не обрабатываются, сохранение отключено до перезапуска
+        logger.critical(f"Не удалось загрузить {DATA_FILE}: бот не готов к работе, файл данных не будет перезаписан")
+        return
+    data_ready.set()
+    log_phase("загрузка данных", started)
+
+@dp.update.outer_middleware()
+async def wait_for_data_middleware(handler, event: Update, data: Dict[str, Any]):
+    """Откладывает обработку обновлений до окончания загрузки данных"""
+    if storage_manager.load_failed:
+        return None
+    if not data_ready.is_set():
+        try:
+            await asyncio.wait_for(data_ready.wait(), DATA_LOAD_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Данные не загрузились за {DATA_LOAD_WAIT_TIMEOUT} сек., обновление {event.update_id} пропущено")
+            return None
+    return await handler(event, data)
+
+dp.update.outer_middleware(handler_load)
+
 def validate_poll_name(name: str) -> Tuple[bool, str]:
     if not name or not name.strip():
         return False, "Название опроса не может быть пустым"
@@ -356,6 +1841,70 @@ def parse_poll_structure(text: str) -> Tuple[bool, Optional[Poll], str]:
     except Exception as e:
         return False, None, f"Ошибка разбора структуры: {str(e)}"
 
+# Массовый импорт опросов из файла
+IMPORT_MAX_FILE_SIZE = int(os.environ.get('IMPORT_MAX_FILE_SIZE', 1024 * 1024))
+IMPORT_MAX_POLLS = int(os.environ.get('IMPORT_MAX_POLLS', 500))
+IMPORT_POOL_WORKERS = int(os.environ.get('IMPORT_POOL_WORKERS', 2))
+IMPORT_CHUNK_SIZE = 50  # опросов на одну задачу пула процессов
+
+def split_import_document(text: str) -> List[Tuple[str, str, int]]:
+    """Делит документ на опросы: строка "# Название" начинает новый опрос, ниже идет его структура"""
+    blocks = []
+    for line_num, line in enumerate(text.splitlines(), 1):
+        if line.startswith('#'):
+            blocks.append((line[1:].strip(), [], line_num))
+        elif blocks:
+            blocks[-1][1].append(line)
+        elif line.strip():
+            # Структура без заголовка: сообщим об ошибке как для опроса без названия
+            blocks.append(('', [line], line_num))
+    return [(name, '\n'.join(lines), line_num) for name, lines, line_num in blocks]
+
+def parse_import_blocks(blocks: List[Tuple[str, str, int]]) -> List[Tuple[bool, Optional[Poll], str]]:
+    """Разбирает пачку опросов; выполняется в отдельном процессе"""
+    results = []
+    for name, structure, _ in blocks:
+        is_valid, error_msg = validate_poll_name(name)
+        if not is_valid:
+            results.append((False, None, error_msg))
+            continue
+        success, poll, error_msg = parse_poll_structure(structure)
+        if success:
+            poll.name = name
+        results.append((success, poll, error_msg))
+    return results
+
+import_executor: Optional[ProcessPoolExecutor] = None
+
+def get_import_executor() -> ProcessPoolExecutor:
+    global import_executor
+    if import_executor is None:
+        import_executor = ProcessPoolExecutor(max_workers=IMPORT_POOL_WORKERS)
+    return import_executor
+
+async def parse_import_chunks(chunks: List[List[Tuple[str, str, int]]]) -> List[List[Tuple[bool, Optional[Poll], str]]]:
+    """Разбирает части файла в пуле процессов; сломанный пул (упавший процесс) пересоздается, разбор повторяется один раз"""
+    global import_executor
+    loop = asyncio.get_running_loop()
+    for attempt in range(2):
+        executor = get_import_executor()
+        try:
+            return await asyncio.gather(*(
+                loop.run_in_executor(executor, parse_import_blocks, chunk) for chunk in chunks
+            ))
+        except BrokenProcessPool:
+            logger.error("Пул процессов импорта сломан, создаем новый")
+            if import_executor is executor:
+                import_executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+            if attempt:
+                raise
+
+@register_shutdown_hook
+async def shutdown_import_executor():
+    if import_executor is not None:
+        await asyncio.to_thread(import_executor.shutdown, cancel_futures=True)
+
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
     keyboard = InlineKeyboardBuilder()
@@ -422,8 +1971,10 @@ async def create_poll_start(callback: CallbackQuery, state: FSMContext):
     await state.set_state(PollCreationStates.awaiting_poll_name)
     
     keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="📥 Импорт из файла", callback_data="import_polls")
     keyboard.button(text="🏠 Главное меню", callback_data="main_menu")
     keyboard.button(text="❌ Отмена", callback_data="cancel")
+    keyboard.adjust(1, 2)
     
     await callback.message.edit_text(
         "Введите название опроса:",
@@ -431,6 +1982,112 @@ async def create_poll_start(callback: CallbackQuery, state: FSMContext):
     )
     await callback.answer()
 
+@dp.callback_query(F.data == "import_polls")
+async def import_polls_start(callback: CallbackQuery, state: FSMContext):
+    await state.set_state(PollCreationStates.awaiting_import_file)
+    
+    instruction = """📥 Отправьте текстовый файл (UTF-8) с несколькими опросами.
+
+Каждый опрос начинается со строки <code># Название</code>, за ней идет структура в обычном формате с отступами.
+
+<b>Пример:</b>
+<code># Фокусник
+Возьмем ли фокусника?
+Да
+  Какого?
+  Витю
+  Сашу
+Нет
+# Программирование
+Нравится ли вам программирование?
+Да
+Нет</code>"""
+    
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="🏠 Главное меню", callback_data="main_menu")
+    keyboard.button(text="❌ Отмена", callback_data="cancel")
+    
+    await callback.message.edit_text(instruction, parse_mode="HTML", reply_markup=keyboard.as_markup())
+    await callback.answer()
+
+@dp.message(PollCreationStates.awaiting_import_file, F.document)
+async def process_import_file(message: Message, state: FSMContext):
+    document = message.document
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await message.answer(f"❌ Файл слишком большой (максимум {IMPORT_MAX_FILE_SIZE // 1024} КБ). Попробуйте еще раз:")
+        return
+    
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="🏠 Главное меню", callback_data="main_menu")
+    
+    buffer = BytesIO()
+    try:
+        await message.bot.download(document, destination=buffer)
+    except (TelegramAPIError, asyncio.TimeoutError) as e:
+        logger.error(f"Не удалось скачать файл импорта от пользователя {message.from_user.id}: {e}")
+        await state.clear()
+        await message.answer("❌ Не удалось скачать файл. Начните импорт заново.", reply_markup=keyboard.as_markup())
+        return
+    try:
+        text = buffer.getvalue().decode('utf-8-sig')
+    except UnicodeDecodeError:
+        await message.answer("❌ Файл должен быть в кодировке UTF-8. Попробуйте еще раз:")
+        return
+    
+    blocks = split_import_document(text)
+    if not blocks:
+        await message.answer("❌ В файле не найдено ни одного опроса. Попробуйте еще раз:")
+        return
+    if len(blocks) > IMPORT_MAX_POLLS:
+        await message.answer(f"❌ В файле {len(blocks)} опросов, можно не больше {IMPORT_MAX_POLLS}. Попробуйте еще раз:")
+        return
+    
+    # Разбор идет в пуле процессов, чтобы большой файл не блокировал обработку других обновлений
+    chunks = [blocks[i:i + IMPORT_CHUNK_SIZE] for i in range(0, len(blocks), IMPORT_CHUNK_SIZE)]
+    try:
+        chunk_results = await parse_import_chunks(chunks)
+    except Exception as e:
+        logger.error(f"Ошибка разбора файла импорта от пользователя {message.from_user.id}: {e}")
+        await state.clear()
+        await message.answer("❌ Не удалось разобрать файл. Начните импорт заново.", reply_markup=keyboard.as_markup())
+        return
+    
+    # Добавляем все успешно разобранные опросы и сохраняем данные один раз
+    report_lines = []
+    imported = 0
+    results = [result for chunk in chunk_results for result in chunk]
+    for (name, _, line_num), (success, poll_data, error_msg) in zip(blocks, results):
+        title = html.escape(name) if name else "без названия"
+        if success:
+            poll_data.created_by = message.from_user.id
+            poll_id = storage_manager.add_poll(message.from_user.id, poll_data)
+            report_lines.append(f"✅ <b>{title}</b> — ID <code>{poll_id}</code>")
+            imported += 1
+        else:
+            report_lines.append(f"❌ <b>{title}</b> (опрос со строки {line_num}): {html.escape(error_msg)}")
+    
+    if imported:
+        storage_manager.save_to_file()
+    
+    await state.clear()
+    
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="📋 Мои опросы", callback_data="my_polls")
+    keyboard.button(text="🏠 Главное меню", callback_data="main_menu")
+    
+    report_lines.insert(0, f"<b>Импорт завершен:</b> {imported} из {len(blocks)} опросов\n")
+    pages = split_into_pages(report_lines)
+    for i, page in enumerate(pages):
+        await message.answer(
+            page,
+            parse_mode="HTML",
+            reply_markup=keyboard.as_markup() if i == len(pages) - 1 else None
+        )
+
+@dp.message(PollCreationStates.awaiting_import_file)
+async def process_import_not_file(message: Message):
+    await message.answer("Отправьте опросы текстовым файлом или нажмите «Отмена».")
+
 @dp.message(PollCreationStates.awaiting_poll_name)
 async def process_poll_name(message: Message, state: FSMContext):
     poll_name = message.text.strip()
@@ -668,8 +2325,59 @@ async def process_poll_structure(message: Message, state: FSMContext):
     await message.answer(structure_info, parse_mode="HTML", reply_markup=keyboard.as_markup())
     storage_manager.save_to_file()
 
+def build_my_polls_page(admin_id: int, order: str = 'created', cursor: Optional[int] = None,
+                        direction: str = 'next', prefix: str = '', search_id: int = 0) -> Tuple[str, InlineKeyboardMarkup]:
+    # search_id попадает в callback_data, чтобы кнопки старых клавиатур не смешивали разные поиски
+    # При поиске по префиксу всегда используем индекс по названию
+    if prefix:
+        order = 'name'
+    
+    poll_ids, has_prev, has_next = storage_manager.poll_index.page(admin_id, order, cursor, direction, prefix)
+    
+    keyboard = InlineKeyboardBuilder()
+    for poll_id in poll_ids:
+        name = storage_manager.get_poll_name(poll_id)
+        if name is not None:
+            icon = "🗄" if storage_manager.is_archived(poll_id) else "📊"
+            keyboard.button(text=f"{icon} {name}", callback_data=f"view_poll_{poll_id}")
+    keyboard.adjust(1)
+    
+    if not prefix:
+        search_id = 0
+    
+    nav_buttons = []
+    if poll_ids and has_prev:
+        nav_buttons.append(InlineKeyboardButton(
+            text="⬅️ Назад", callback_data=f"my_polls_page_{order}_prev_{poll_ids[0]}_{search_id}"
+        ))
+    if poll_ids and has_next:
+        nav_buttons.append(InlineKeyboardButton(
+            text="Вперед ➡️", callback_data=f"my_polls_page_{order}_next_{poll_ids[-1]}_{search_id}"
+        ))
+    if nav_buttons:
+        keyboard.row(*nav_buttons)
+    
+    if prefix:
+        keyboard.row(InlineKeyboardButton(text="✖️ Сбросить поиск", callback_data="my_polls"))
+    else:
+        keyboard.row(*[
+            InlineKeyboardButton(text=f"↕️ {POLL_SORT_LABELS[other]}", callback_data=f"my_polls_page_{other}_next_0_0")
+            for other in POLL_SORT_ORDERS if other != order
+        ])
+    keyboard.row(InlineKeyboardButton(text="🔍 Поиск по названию", callback_data="my_polls_search"))
+    keyboard.row(InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu"))
+    
+    if prefix:
+        text = f"Опросы, название которых начинается с «{html.escape(prefix)}»:"
+        if not poll_ids:
+            text = f"Опросы, название которых начинается с «{html.escape(prefix)}», не найдены."
+    else:
+        text = f"Ваши опросы (сортировка {POLL_SORT_LABELS[order]}):"
+    
+    return text, keyboard.as_markup()
+
 @dp.callback_query(F.data == "my_polls")
-async def show_my_polls(callback: CallbackQuery):
+async def show_my_polls(callback: CallbackQuery, state: FSMContext):
     admin_id = callback.from_user.id
     user_polls = storage_manager.admin_polls[admin_id]
     
@@ -683,25 +2391,91 @@ async def show_my_polls(callback: CallbackQuery):
         await callback.answer()
         return
     
-    keyboard = InlineKeyboardBuilder()
-    for poll_id in user_polls:
-        poll = storage_manager.get_poll(poll_id)
-        if poll:
-            keyboard.button(text=f"📊 {poll.name}", callback_data=f"view_poll_{poll_id}")
+    await state.set_state(None)
+    await state.update_data(search_prefix='')
+    
+    text, markup = build_my_polls_page(admin_id)
+    await callback.message.edit_text(text, reply_markup=markup)
+    await callback.answer()
+
+@dp.callback_query(F.data.startswith("my_polls_page_"))
+async def show_my_polls_page(callback: CallbackQuery, state: FSMContext):
+    # Формат: my_polls_page_{order}_{direction}_{cursor}_{search_id}, search_id=0 - без поиска
+    parts = callback.data.split("_")
+    if len(parts) != 7 or parts[3] not in POLL_SORT_ORDERS or parts[4] not in ('next', 'prev'):
+        await callback.answer("Неверный формат данных", show_alert=True)
+        return
+    
+    try:
+        cursor = int(parts[5])
+        search_id = int(parts[6])
+    except ValueError:
+        await callback.answer("Неверный формат данных", show_alert=True)
+        return
+    
+    data = await state.get_data()
+    prefix = ''
+    notice = None
+    if search_id:
+        if search_id == data.get('search_id') and data.get('search_prefix'):
+            prefix = data['search_prefix']
+        else:
+            # Кнопка от предыдущего поиска - показываем список без фильтра с первой страницы
+            cursor = 0
+            notice = "Результаты этого поиска устарели"
+    
+    text, markup = build_my_polls_page(
+        callback.from_user.id,
+        order=parts[3],
+        cursor=cursor or None,
+        direction=parts[4],
+        prefix=prefix,
+        search_id=search_id
+    )
+    await callback.message.edit_text(text, reply_markup=markup)
+    await callback.answer(notice)
+
+@dp.callback_query(F.data == "my_polls_search")
+async def search_my_polls(callback: CallbackQuery, state: FSMContext):
+    await state.set_state(PollSearchStates.awaiting_name_prefix)
     
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="📋 Мои опросы", callback_data="my_polls")
     keyboard.button(text="🏠 Главное меню", callback_data="main_menu")
-    keyboard.adjust(1)
     
     await callback.message.edit_text(
-        "Ваши опросы:",
+        "Введите начало названия опроса:",
         reply_markup=keyboard.as_markup()
     )
     await callback.answer()
 
+@dp.message(PollSearchStates.awaiting_name_prefix)
+async def process_search_prefix(message: Message, state: FSMContext):
+    prefix = (message.text or '').strip()
+    
+    is_valid, error_msg = validate_poll_name(prefix)
+    if not is_valid:
+        await message.answer(f"❌ {error_msg}. Попробуйте еще раз:")
+        return
+    
+    search_id = (await state.get_data()).get('search_id', 0) + 1
+    await state.set_state(None)
+    await state.update_data(search_prefix=prefix, search_id=search_id)
+    
+    text, markup = build_my_polls_page(message.from_user.id, prefix=prefix, search_id=search_id)
+    await message.answer(text, reply_markup=markup)
+
 @dp.callback_query(F.data.startswith("view_poll_"))
 async def view_poll_details(callback: CallbackQuery):
-    poll_id = int(callback.data.split("_")[2])
-    poll = storage_manager.get_poll(poll_id)
+    # Формат: view_poll_{poll_id} или view_poll_{poll_id}_{page}
+    parts = callback.data.split("_")
+    try:
+        poll_id = int(parts[2])
+        page = int(parts[3]) if len(parts) > 3 else 0
+    except (IndexError, ValueError):
+        await callback.answer("Неверный формат данных", show_alert=True)
+        return
+    poll = await load_poll(poll_id)
     
     if not poll:
         await callback.message.edit_text(
@@ -713,30 +2487,64 @@ async def view_poll_details(callback: CallbackQuery):
         await callback.answer()
         return
     
-    details = f"<b>Опрос: {poll.name}</b>\n"
-    details += f"<b>ID:</b> {poll_id}\n\n"
+    rendered = poll_render_cache.get(poll_id, poll)
+    total_pages = len(rendered.pages)
+    page = max(0, min(page, total_pages - 1))
     
-    for i, question in enumerate(poll.questions):
-        details += f"<b>Вопрос {i+1}:</b> {question.text}\n"
-        details += f"<b>Уровень:</b> {question.level}\n"
-        details += f"<b>Ответы:</b>\n"
-        for answer in question.answers:
-            next_q = answer.next_question if answer.next_question is not None else 'нет'
-            details += f"  - {answer.text} (след. вопрос: {next_q})\n"
-        details += "\n"
+    details = f"<b>Опрос: {html.escape(poll.name)}</b>\n"
+    details += f"<b>ID:</b> {poll_id}\n"
+    details += f"<b>Всего вопросов:</b> {len(poll.questions)}\n\n"
     
     keyboard = InlineKeyboardBuilder()
     keyboard.button(text="🚀 Начать опрос", callback_data=f"start_poll_{poll_id}")
+    keyboard.button(text="📊 Результаты", callback_data=f"results_poll_{poll_id}")
+    keyboard.button(text="📈 Динамика", callback_data=f"history_poll_{poll_id}")
     keyboard.button(text="🏠 Главное меню", callback_data="main_menu")
     keyboard.button(text="📋 Мои опросы", callback_data="my_polls")
+    if total_pages > DOCUMENT_PAGE_THRESHOLD:
+        keyboard.button(text="📄 Структура файлом", callback_data=f"doc_poll_{poll_id}")
+    keyboard.adjust(1, 2, 2)
+    
+    if total_pages > DOCUMENT_PAGE_THRESHOLD:
+        details += "Структура опроса слишком большая для сообщения, её можно получить файлом."
+    else:
+        if total_pages > 1:
+            details += f"<i>Страница {page + 1} из {total_pages}</i>\n\n"
+            nav_buttons = []
+            if page > 0:
+                nav_buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"view_poll_{poll_id}_{page - 1}"))
+            if page < total_pages - 1:
+                nav_buttons.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=f"view_poll_{poll_id}_{page + 1}"))
+            keyboard.row(*nav_buttons)
+        details += rendered.pages[page]
     
     await callback.message.edit_text(details, parse_mode="HTML", reply_markup=keyboard.as_markup())
     await callback.answer()
 
+@dp.callback_query(F.data.startswith("doc_poll_"))
+async def send_poll_document(callback: CallbackQuery):
+    try:
+        poll_id = int(callback.data.split("_")[2])
+    except (IndexError, ValueError):
+        await callback.answer("Неверный формат данных", show_alert=True)
+        return
+    poll = await load_poll(poll_id)
+    
+    if not poll:
+        await callback.answer("Опрос не найден", show_alert=True)
+        return
+    
+    rendered = poll_render_cache.get(poll_id, poll)
+    await callback.message.answer_document(
+        BufferedInputFile(rendered.document, filename=f"poll_{poll_id}.txt"),
+        caption=f"Структура опроса <b>{html.escape(poll.name)}</b>"
+    )
+    await callback.answer()
+
 @dp.callback_query(F.data.startswith("start_poll_"))
 async def start_poll_in_chat(callback: CallbackQuery):
     poll_id = int(callback.data.split("_")[2])
-    poll = storage_manager.get_poll(poll_id)
+    poll = await load_poll(poll_id)
     
     if not poll:
         await callback.message.edit_text(
@@ -763,8 +2571,8 @@ async def start_poll_in_chat(callback: CallbackQuery):
     
     # Проверяем права администратора
     try:
-        member = await bot.get_chat_member(chat_id, callback.from_user.id)
-        if not member.status in ['administrator', 'creator']:
+        is_admin = await chat_member_cache.is_admin(callback.bot, chat_id, callback.from_user.id)
+        if not is_admin:
             await callback.message.edit_text(
                 "❌ Для начала опроса вы должны быть администратором группы!",
                 reply_markup=InlineKeyboardBuilder()
@@ -803,6 +2611,11 @@ async def start_poll_in_chat(callback: CallbackQuery):
     )
     await callback.answer()
 
+@dp.chat_member()
+async def handle_chat_member_update(event: ChatMemberUpdated):
+    """Обновляет кэш статусов; такие обновления приходят, только если бот администратор чата"""
+    chat_member_cache.set(event.chat.id, event.new_chat_member.user.id, event.new_chat_member)
+
 @dp.callback_query(F.data.startswith("poll_"))
 async def handle_poll_answer(callback: CallbackQuery):
     # Формат: poll_{poll_id}_{question_idx}_{answer_text}
@@ -819,13 +2632,14 @@ async def handle_poll_answer(callback: CallbackQuery):
         await callback.answer("Неверный формат данных", show_alert=True)
         return
     
-    poll = storage_manager.get_poll(poll_id)
+    poll = await load_poll(poll_id)
     if not poll:
         await callback.answer("Опрос не найден", show_alert=True)
         return
     
-    # Обновляем результаты
-    storage_manager.record_answer(poll_id, question_idx, answer_text)
+    if question_idx < 0 or question_idx >= len(poll.questions):
+        await callback.answer("Неверный формат данных", show_alert=True)
+        return
     
     # Обновляем прогресс пользователя
     user_id = callback.from_user.id
@@ -834,10 +2648,20 @@ async def handle_poll_answer(callback: CallbackQuery):
     if chat_id not in storage_manager.user_progress:
         storage_manager.user_progress[chat_id] = {}
     
-    if user_id not in storage_manager.user_progress[chat_id]:
-        storage_manager.user_progress[chat_id][user_id] = {'current_poll': poll_id, 'answers': {}}
+    progress = storage_manager.user_progress[chat_id].get(user_id)
+    if progress is None or progress['current_poll'] != poll_id:
+        progress = {'current_poll': poll_id, 'answers': {}}
+        storage_manager.user_progress[chat_id][user_id] = progress
     
-    storage_manager.user_progress[chat_id][user_id]['answers'][question_idx] = answer_text
+    first_time = question_idx not in progress['answers']
+    progress['answers'][question_idx] = answer_text
+    
+    # Обновляем результаты
+    storage_manager.record_answer(
+        poll_id, question_idx, answer_text,
+        first_time=first_time,
+        respondent=(chat_id, user_id)
+    )
     
     # Находим следующий вопрос
     current_question = poll.questions[question_idx]
@@ -871,6 +2695,129 @@ async def handle_poll_answer(callback: CallbackQuery):
     storage_manager.save_to_file()
     await callback.answer()
 
+def format_funnel(report: Dict[str, Any]) -> str:
+    if not report['started']:
+        return ""
+    
+    text = f"\n  <b>Воронка:</b> начали {report['started']}, завершили {report['completed']} "
+    text += f"({report['completion_rate']:.0%})\n"
+    for node in report['nodes']:
+        indent = '  ' * (node['depth'] + 2)
+        text += f"{indent}{html.escape(node['text'])} — дошли {node['reached']} ({node['reach_rate']:.0%})"
+        if node['dropped']:
+            text += f", ушли {node['dropped']} ({node['drop_off_rate']:.0%})"
+        text += "\n"
+    return text
+
+def format_poll_results(poll_id: int, poll: Poll, with_funnel: bool = True) -> str:
+    results_text = f"<b>{html.escape(poll.name)} (ID: {poll_id})</b>\n"
+    
+    for q_idx, question in enumerate(poll.questions):
+        results_text += f"\n  <b>Вопрос {q_idx+1}:</b> {html.escape(question.text)}\n"
+        for answer_text, count in storage_manager.poll_results[poll_id][q_idx].items():
+            results_text += f"    - {html.escape(answer_text)}: {count}\n"
+    
+    if with_funnel:
+        results_text += format_funnel(storage_manager.funnel.report(poll_id, poll))
+    return results_text
+
+@dp.callback_query(F.data.startswith("results_poll_"))
+async def show_poll_results(callback: CallbackQuery):
+    # Формат: results_poll_{poll_id} или results_poll_{poll_id}_{page}
+    parts = callback.data.split("_")
+    try:
+        poll_id = int(parts[2])
+        page = int(parts[3]) if len(parts) > 3 else 0
+    except (IndexError, ValueError):
+        await callback.answer("Неверный формат данных", show_alert=True)
+        return
+    poll = await load_poll(poll_id)
+    
+    if not poll:
+        await callback.answer("Опрос не найден", show_alert=True)
+        return
+    
+    pages = split_into_pages(format_poll_results(poll_id, poll).split("\n"))
+    page = max(0, min(page, len(pages) - 1))
+    results_text = pages[page]
+    
+    keyboard = InlineKeyboardBuilder()
+    if len(pages) > 1:
+        results_text += f"\n<i>Страница {page + 1} из {len(pages)}</i>"
+        nav_buttons = []
+        if page > 0:
+            nav_buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"results_poll_{poll_id}_{page - 1}"))
+        if page < len(pages) - 1:
+            nav_buttons.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=f"results_poll_{poll_id}_{page + 1}"))
+        keyboard.row(*nav_buttons)
+    keyboard.row(
+        InlineKeyboardButton(text="⬅️ К опросу", callback_data=f"view_poll_{poll_id}"),
+        InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")
+    )
+    
+    await callback.message.edit_text(results_text, parse_mode="HTML", reply_markup=keyboard.as_markup())
+    await callback.answer()
+
+SPARKLINE_BLOCKS = "▁▂▃▄▅▆▇█"
+
+def sparkline(values: List[int]) -> str:
+    peak = max(values, default=0)
+    if not peak:
+        return SPARKLINE_BLOCKS[0] * len(values)
+    return ''.join(SPARKLINE_BLOCKS[(value * (len(SPARKLINE_BLOCKS) - 1) + peak - 1) // peak] for value in values)
+
+@dp.callback_query(F.data.startswith("history_poll_"))
+async def show_poll_history(callback: CallbackQuery):
+    try:
+        poll_id = int(callback.data.split("_")[2])
+    except (IndexError, ValueError):
+        await callback.answer("Неверный формат данных", show_alert=True)
+        return
+    poll = await load_poll(poll_id)
+    
+    if not poll:
+        await callback.answer("Опрос не найден", show_alert=True)
+        return
+    
+    now = time.time()
+    rollups = storage_manager.rollups
+    minutes = rollups.totals(poll_id, 'minute', now)
+    hours = rollups.totals(poll_id, 'hour', now)
+    days = [sum(hours[i:i + 24]) for i in range(0, len(hours), 24)]
+    
+    text = f"<b>Динамика голосов: {html.escape(poll.name)}</b>\n\n"
+    text += f"За последний час: {sum(minutes[-60:])}\n"
+    text += f"За сутки: {sum(minutes)}\n"
+    text += f"За 30 дней: {sum(hours)}\n"
+    text += f"Скорость за последние 10 минут: {sum(minutes[-10:]) / 10:.1f} голосов/мин\n\n"
+    text += f"<b>Сутки по часам:</b>\n<code>{sparkline(hours[-24:])}</code>\n"
+    text += f"<b>30 дней по дням:</b>\n<code>{sparkline(days)}</code>\n"
+    
+    # Самые активные ответы за сутки
+    daily = []
+    for q_idx, question in enumerate(poll.questions):
+        for a_idx, answer in enumerate(question.answers):
+            count = sum(rollups.answer_series(poll_id, q_idx, a_idx, 'minute', now))
+            if count:
+                daily.append((count, question.text, answer.text))
+    if daily:
+        text += "\n<b>Ответы за сутки:</b>\n"
+        for count, question_text, answer_text in sorted(daily, reverse=True)[:10]:
+            text += f"  {html.escape(question_text)} → {html.escape(answer_text)}: {count}\n"
+    
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="🔄 Обновить", callback_data=f"history_poll_{poll_id}")
+    keyboard.button(text="⬅️ К опросу", callback_data=f"view_poll_{poll_id}")
+    keyboard.button(text="🏠 Главное меню", callback_data="main_menu")
+    keyboard.adjust(1, 2)
+    
+    try:
+        await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard.as_markup())
+    except TelegramAPIError:
+        # При обновлении без новых голосов Telegram сообщает, что сообщение не изменилось
+        pass
+    await callback.answer()
+
 @dp.callback_query(F.data == "show_results")
 async def show_results(callback: CallbackQuery):
     admin_id = callback.from_user.id
@@ -889,17 +2836,17 @@ async def show_results(callback: CallbackQuery):
     results_text = "<b>Результаты ваших опросов:</b>\n\n"
     
     for poll_id in user_polls:
+        # Архивные опросы не поднимаем целиком, их результаты открываются из карточки опроса
+        if storage_manager.is_archived(poll_id):
+            results_text += f"🗄 <b>{html.escape(storage_manager.get_poll_name(poll_id))} (ID: {poll_id})</b> — в архиве\n\n"
+            continue
+        
         poll = storage_manager.get_poll(poll_id)
         if not poll:
             continue
-            
-        results_text += f"<b>{poll.name} (ID: {poll_id})</b>\n"
-        
-        for q_idx, question in enumerate(poll.questions):
-            results_text += f"\n  <b>Вопрос {q_idx+1}:</b> {question.text}\n"
-            for answer_text, count in storage_manager.poll_results[poll_id][q_idx].items():
-                results_text += f"    - {answer_text}: {count}\n"
         
+        # Воронка по веткам есть только в результатах отдельного опроса, иначе сводка не помещается в сообщение
+        results_text += format_poll_results(poll_id, poll, with_funnel=False)
         results_text += "\n"
     
     keyboard = InlineKeyboardBuilder()
@@ -914,11 +2861,128 @@ async def handle_health_check(request):
     """Обработчик для проверки состояния сервиса Render"""
     return web.Response(text="Bot is running!")
 
+async def handle_metrics(request):
+    """Метрики пула соединений к Bot API и ограничения нагрузки"""
+    return web.json_response({**bot.session.metrics.snapshot(), **callback_throttle.snapshot()})
+
+async def handle_ready_check(request):
+    """Готовность: данные загружены и бот обрабатывает обновления"""
+    if storage_manager.load_failed:
+        return web.Response(status=503, text="Data load failed")
+    if not data_ready.is_set():
+        return web.Response(status=503, text="Loading data")
+    return web.Response(text="Ready")
+
+# Токен для доступа к выгрузке результатов; без него выгрузка отключена
+EXPORT_API_TOKEN = os.environ.get('EXPORT_API_TOKEN', '')
+
+async def get_export_poll(request) -> Tuple[int, Poll]:
+    """Проверяет токен выгрузки и возвращает запрошенный опрос"""
+    if not EXPORT_API_TOKEN:
+        raise web.HTTPNotFound()
+    # Токен принимаем только в заголовке: параметры запроса попадают в журнал доступа aiohttp
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not hmac.compare_digest(token.encode(), EXPORT_API_TOKEN.encode()):
+        raise web.HTTPForbidden()
+    # До загрузки данных выгрузка вернула бы пустые результаты
+    if not data_ready.is_set():
+        raise web.HTTPServiceUnavailable()
+    
+    try:
+        poll_id = int(request.match_info['poll_id'])
+    except ValueError:
+        raise web.HTTPBadRequest()
+    poll = await load_poll(poll_id)
+    if not poll:
+        raise web.HTTPNotFound()
+    return poll_id, poll
+
+async def handle_export_poll(request):
+    """Выгрузка результатов и воронки опроса в JSON"""
+    poll_id, poll = await get_export_poll(request)
+    return web.json_response({
+        'poll_id': poll_id,
+        'name': poll.name,
+        'results': {
+            str(q_idx): dict(answers)
+            for q_idx, answers in storage_manager.poll_results[poll_id].items()
+        },
+        'funnel': storage_manager.funnel.report(poll_id, poll)
+    }, dumps=lambda obj: json.dumps(obj, ensure_ascii=False))
+
+def parse_answer_filters(raw: str, poll: Poll) -> Dict[int, int]:
+    """Разбирает фильтры вида "0:1,2:0" (вопрос:ответ) с проверкой индексов"""
+    filters = {}
+    for item in filter(None, raw.split(',')):
+        q_str, _, a_str = item.partition(':')
+        question_idx, answer_idx = int(q_str), int(a_str)
+        if not 0 <= question_idx < len(poll.questions) or not 0 <= answer_idx < len(poll.questions[question_idx].answers):
+            raise ValueError(item)
+        filters[question_idx] = answer_idx
+    return filters
+
+async def handle_export_crosstab(request):
+    """Таблица сопряженности ответов двух вопросов с необязательными фильтрами"""
+    poll_id, poll = await get_export_poll(request)
+    try:
+        row_question = int(request.query.get('row', 0))
+        col_question = int(request.query['col'])
+        filters = parse_answer_filters(request.query.get('filter', ''), poll)
+        if not 0 <= row_question < len(poll.questions) or not 0 <= col_question < len(poll.questions):
+            raise ValueError(row_question, col_question)
+    except (KeyError, ValueError):
+        raise web.HTTPBadRequest(text="Ожидаются параметры row, col и filter=вопрос:ответ,...")
+    
+    table = storage_manager.responses.crosstab(poll_id, poll, row_question, col_question, filters)
+    row_answers = poll.questions[row_question].answers
+    col_answers = poll.questions[col_question].answers
+    return web.json_response({
+        'poll_id': poll_id,
+        'row_question': poll.questions[row_question].text,
+        'col_question': poll.questions[col_question].text,
+        'respondents': storage_manager.responses.count(poll_id, filters),
+        'crosstab': {
+            row_answers[r].text: {col_answers[c].text: n for c, n in enumerate(counts)}
+            for r, counts in enumerate(table)
+        }
+    }, dumps=lambda obj: json.dumps(obj, ensure_ascii=False))
+
+async def handle_export_timeseries(request):
+    """Динамика голосов опроса по минутам (последние сутки) или по часам (последние 30 дней)"""
+    poll_id, poll = await get_export_poll(request)
+    resolution = request.query.get('resolution', 'minute')
+    if resolution not in ROLLUP_RESOLUTIONS:
+        raise web.HTTPBadRequest(text="resolution должен быть minute или hour")
+    
+    step, size = ROLLUP_RESOLUTIONS[resolution]
+    now = time.time()
+    rollups = storage_manager.rollups
+    return web.json_response({
+        'poll_id': poll_id,
+        'resolution': resolution,
+        'step': step,
+        'start': (int(now // step) - size + 1) * step,
+        'totals': rollups.totals(poll_id, resolution, now),
+        'answers': [
+            {
+                'question': poll.questions[q_idx].text,
+                'answer': poll.questions[q_idx].answers[a_idx].text,
+                'counts': rollups.answer_series(poll_id, q_idx, a_idx, resolution, now)
+            }
+            for q_idx, a_idx in sorted(rollups.series.get(poll_id, {}))
+        ]
+    }, dumps=lambda obj: json.dumps(obj, ensure_ascii=False))
+
 async def start_http_server():
     """Запуск HTTP-сервера для Render"""
     app = web.Application()
     app.router.add_get('/health', handle_health_check)
+    app.router.add_get('/ready', handle_ready_check)
+    app.router.add_get('/metrics', handle_metrics)
     app.router.add_get('/', handle_health_check)
+    app.router.add_get('/export/polls/{poll_id}', handle_export_poll)
+    app.router.add_get('/export/polls/{poll_id}/crosstab', handle_export_crosstab)
+    app.router.add_get('/export/polls/{poll_id}/timeseries', handle_export_timeseries)
     
     # Используем порт из переменной окружения PORT, как рекомендует Render
     port = int(os.environ.get('PORT', 10000))  # 10000 - порт по умолчанию для Render
@@ -930,10 +2994,78 @@ async def start_http_server():
     return runner
 # --- Конец добавленного кода ---
 
+analytics_lock = asyncio.Lock()
+
+@register_shutdown_hook
+async def flush_analytics():
+    """Сбрасывает на диск аналитику опросов, измененных с прошлого сброса"""
+    async with analytics_lock:
+        snapshots = storage_manager.collect_dirty_analytics()
+        if not snapshots:
+            return
+        write = asyncio.ensure_future(asyncio.to_thread(storage_manager.write_analytics, snapshots))
+        try:
+            failed = await asyncio.shield(write)
+        except asyncio.CancelledError:
+            # Поток записи не прервать: дожидаемся его, чтобы два сброса не писали файлы одновременно
+            storage_manager.analytics_dirty.update(await write)
+            raise
+        storage_manager.analytics_dirty.update(failed)
+
+async def analytics_flush_loop():
+    """Периодически сбрасывает аналитику опросов вне снимка, который пишется на каждый голос"""
+    await data_ready.wait()
+    while True:
+        await asyncio.sleep(ANALYTICS_FLUSH_INTERVAL)
+        await flush_analytics()
+
+async def archive_inactive_polls(max_idle_seconds: float) -> int:
+    """Переносит неактивные опросы в архив; сжатие и запись файлов идут в отдельном потоке"""
+    archived = 0
+    for poll_id in storage_manager.archive_candidates(max_idle_seconds):
+        if poll_id not in storage_manager.polls:
+            continue
+        activity = storage_manager.poll_activity.get(poll_id)
+        try:
+            snapshot = storage_manager.archive_snapshot(poll_id)
+            await asyncio.to_thread(storage_manager.write_archive, poll_id, snapshot)
+        except Exception as e:
+            logger.error(f"Ошибка архивации опроса {poll_id}: {e}")
+            continue
+        
+        # Пока файл писался, опрос могли запустить в чате или ответить на него - тогда оставляем в памяти
+        if (poll_id in storage_manager.polls and storage_manager.poll_activity.get(poll_id) == activity
+                and poll_id not in storage_manager.active_polls.values()):
+            storage_manager.drop_archived(poll_id)
+            archived += 1
+    return archived
+
+async def archive_loop():
+    """Периодически переносит неактивные опросы в холодный архив"""
+    await data_ready.wait()
+    while True:
+        await asyncio.sleep(ARCHIVE_CHECK_INTERVAL)
+        archived = await archive_inactive_polls(ARCHIVE_AFTER_DAYS * 86400)
+        if archived:
+            logger.info(f"В архив перенесено опросов: {archived}")
+            await save_data()
+
 async def handle_updates():
     """Обработчик обновлений с обработкой исключений"""
+    if stop_requested.is_set():
+        logger.info("Остановка запрошена до запуска polling")
+        return
+    
+    # Сигналы и закрытие сессии обрабатываются в main() и shutdown()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+    stop_wait = asyncio.create_task(stop_requested.wait())
     try:
-        await dp.start_polling(bot)
+        await asyncio.wait({polling, stop_wait}, return_when=asyncio.FIRST_COMPLETED)
+        # Пока polling не дошел до ожидания остановки, dp.stop_polling() не действует - повторяем
+        while not polling.done():
+            await stop_polling()
+            await asyncio.wait({polling}, timeout=0.1)
+        await polling
     except TelegramRetryAfter as e:
         logger.warning(f"Telegram требует подождать: {e.retry_after} сек.")
         await asyncio.sleep(e.retry_after)
@@ -941,23 +3073,33 @@ async def handle_updates():
         logger.error(f"Ошибка API Telegram: {e}")
     except Exception as e:
         logger.error(f"Неожиданная ошибка: {e}")
+    finally:
+        stop_wait.cancel()
 
 async def main():
     global bot_instance_running
     
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, signal_handler, signum)
     
     logger.info("=== Запуск бота для создания опросов ===")
-    
-    # Загружаем данные
-    storage_manager.load_from_file()
+    startup_started = time.perf_counter()
     
     try:
-        # --- Запускаем HTTP-сервер перед polling ---
+        # --- Запускаем HTTP-сервер до загрузки данных, чтобы health check отвечал сразу ---
+        phase_started = time.perf_counter()
         http_runner = await start_http_server()
+        log_phase("HTTP-сервер", phase_started)
+        
+        # Загружаем данные в фоне, обновления ждут их в wait_for_data_middleware
+        load_task = asyncio.create_task(load_data())
+        archive_task = asyncio.create_task(archive_loop())
+        analytics_task = asyncio.create_task(analytics_flush_loop())
+        
         bot_instance_running = True
         logger.info("Запуск polling...")
+        log_phase("запуск до polling", startup_started)
         await handle_updates()
     except KeyboardInterrupt:
         logger.info("Получен сигнал прерывания")
@@ -966,10 +3108,21 @@ async def main():
         raise
     finally:
         bot_instance_running = False
+        if 'archive_task' in locals():
+            archive_task.cancel()
+        if 'analytics_task' in locals():
+            analytics_task.cancel()
+        # Недозагруженные данные shutdown() не сохраняет (data_ready не установлен), поэтому загрузку не ждем
+        if 'load_task' in locals() and not load_task.done():
+            load_task.cancel()
+            try:
+                await load_task
+            except asyncio.CancelledError:
+                pass
+        await shutdown()
         # Останавливаем HTTP-сервер
         if 'http_runner' in locals():
             await http_runner.cleanup()
-        await bot.session.close()
         logger.info("Бот остановлен")
 
 if __name__ == '__main__':
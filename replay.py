@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+import zlib
+from typing import List
+
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Update
+
+from stub_api import StubBotAPI
+
+
+# Воспроизведение записанных обновлений (UPDATE_RECORD_PATH) через dp.feed_update на заглушке Bot API
+def read_updates(path: str):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Пропущена недописанная строка записи: {line[:80]!r}")
+                    continue
+                yield record['t'], record['update']
+        except (EOFError, zlib.error):
+            # Запись прервана сбоем: воспроизводим все, что было сброшено на диск
+            print(f"Файл {path} обрывается, воспроизводим обновления до места обрыва")
+
+
+def percentile(values: List[float], p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else 0.0
+
+
+async def replay(args):
+    # Бот работает с копиями во временном каталоге: рабочие данные, аналитика и архив не меняются
+    workdir = tempfile.mkdtemp()
+    data_file = os.path.join(workdir, 'poll_data.json')
+    if args.data_file:
+        shutil.copy(args.data_file, data_file)
+        source_dir = os.path.dirname(os.path.abspath(args.data_file))
+        for name in ('poll_analytics', 'poll_archive'):
+            if os.path.isdir(os.path.join(source_dir, name)):
+                shutil.copytree(os.path.join(source_dir, name), os.path.join(workdir, name))
+    os.environ['POLL_DATA_FILE'] = data_file
+    os.environ['POLL_ANALYTICS_DIR'] = os.path.join(workdir, 'poll_analytics')
+    os.environ['POLL_ARCHIVE_DIR'] = os.path.join(workdir, 'poll_archive')
+    os.environ.pop('UPDATE_RECORD_PATH', None)
+    import bot as bot_module
+
+    stub = StubBotAPI(latency=args.api_latency)
+    url = await stub.start()
+    bot = bot_module.bot
+    bot.session = bot_module.TunedAiohttpSession(api=TelegramAPIServer.from_base(url))
+    await bot_module.load_data()
+
+    latencies = []
+    errors = 0
+    in_flight = asyncio.Semaphore(args.max_in_flight)
+    tasks = set()
+
+    async def feed(raw):
+        nonlocal errors
+        try:
+            update = Update.model_validate(raw, context={'bot': bot})
+            started = time.perf_counter()
+            await bot_module.dp.feed_update(bot, update)
+            latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            errors += 1
+            if args.verbose:
+                print(f"Ошибка обработки обновления {raw.get('update_id')}: {e}")
+        finally:
+            in_flight.release()
+
+    replay_started = time.perf_counter()
+    first_ts = None
+    for ts, raw in read_updates(args.file):
+        if first_ts is None:
+            first_ts = ts
+        if args.speed > 0:
+            delay = (ts - first_ts) / args.speed - (time.perf_counter() - replay_started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        await in_flight.acquire()
+        task = asyncio.create_task(feed(raw))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - replay_started
+
+    await bot_module.shutdown()
+    await stub.stop()
+
+    latencies.sort()
+    total = len(latencies) + errors
+    print(f"Обновлений: {total}, ошибок: {errors}, время: {elapsed:.2f} сек.")
+    print(f"Пропускная способность: {total / elapsed if elapsed else 0:.0f} обновлений/сек.")
+    print(f"Задержка обработки, мс: p50={percentile(latencies, 0.5):.1f} "
+          f"p95={percentile(latencies, 0.95):.1f} p99={percentile(latencies, 0.99):.1f} "
+          f"max={latencies[-1] * 1000 if latencies else 0.0:.1f}")
+    print(f"Запросов к Bot API: {stub.requests} {dict(sorted(stub.methods.items()))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Воспроизведение записанных обновлений бота')
+    parser.add_argument('file', help='файл NDJSON.gz, записанный через UPDATE_RECORD_PATH')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='множитель скорости: 1 - как в записи, N - в N раз быстрее, 0 - максимально быстро')
+    parser.add_argument('--max-in-flight', type=int, default=1000, help='ограничение одновременно обрабатываемых обновлений (1 - строго по порядку записи)')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='задержка ответа заглушки Bot API, сек.')
+    parser.add_argument('--data-file', default='', help='файл данных бота; копируется во временный каталог вместе с poll_analytics и poll_archive рядом с ним (по умолчанию пустые данные)')
+    parser.add_argument('--verbose', action='store_true', help='выводить ошибки обработки')
+    asyncio.run(replay(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
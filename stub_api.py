@@ -0,0 +1,105 @@
+import asyncio
+import json
+import time
+import weakref
+from typing import Any, Dict
+
+from aiohttp import web
+
+# Локальная заглушка Bot API для бенчмарков и воспроизведения нагрузки
+STUB_BOT_TOKEN = '42:STUB-TOKEN'
+STUB_BOT_USER = {'id': 42, 'is_bot': True, 'first_name': 'Stub', 'username': 'stub_bot'}
+
+
+class StubBotAPI:
+    """Отвечает на любой метод Bot API правдоподобным результатом с заданной задержкой.
+    
+    Каждый stall_every-й запрос зависает на stall сек., как медленный ответ Telegram.
+    """
+    def __init__(self, latency: float = 0.0, stall_every: int = 0, stall: float = 0.0):
+        self.latency = latency
+        self.stall_every = stall_every
+        self.stall = stall
+        self.requests = 0
+        self.methods: Dict[str, int] = {}
+        self._transports = weakref.WeakSet()
+        self.connections = 0
+        self._message_id = 0
+        self._runner = None
+        self.url = ''
+
+    async def _read_params(self, request: web.Request) -> Dict[str, Any]:
+        if request.content_type == 'application/json':
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[key] = value
+        return params
+
+    def _message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        self._message_id += 1
+        chat_id = params.get('chat_id', 1)
+        return {
+            'message_id': params.get('message_id', self._message_id),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'supergroup' if chat_id < 0 else 'private', 'title': 'Stub'},
+            'from': STUB_BOT_USER,
+            'text': params.get('text', ''),
+        }
+
+    def _result(self, method: str, params: Dict[str, Any]) -> Any:
+        method = method.lower()
+        if method == 'getme':
+            return STUB_BOT_USER
+        if method == 'getupdates':
+            return []
+        if method in ('sendmessage', 'senddocument', 'editmessagetext'):
+            return self._message(params)
+        if method == 'getchatmember':
+            return {
+                'status': 'creator',
+                'is_anonymous': False,
+                'user': {'id': params.get('user_id', 1), 'is_bot': False, 'first_name': 'User'},
+            }
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if request.transport not in self._transports:
+            self._transports.add(request.transport)
+            self.connections += 1
+
+        method = request.match_info['method']
+        params = await self._read_params(request)
+        self.requests += 1
+        self.methods[method] = self.methods.get(method, 0) + 1
+
+        if method.lower() == 'getupdates':
+            # Long polling без обновлений
+            await asyncio.sleep(min(float(params.get('timeout', 0) or 0), 1.0))
+        elif self.stall_every and self.requests % self.stall_every == 0:
+            await asyncio.sleep(self.stall)
+        elif self.latency:
+            await asyncio.sleep(self.latency)
+
+        return web.json_response({'ok': True, 'result': self._result(method, params)})
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        # Очередь подключений больше всплеска запросов, иначе ее переполнение добавит секундные повторы SYN
+        site = web.TCPSite(self._runner, host, port, backlog=1024)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://{host}:{port}'
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()